@@ -0,0 +1,87 @@
+"""
+Synthetic test media for the benchmarks.
+
+A needle is a burst of seeded white noise, a haystack is quieter noise with the needle mixed in at a known offset.
+Haystacks are written as 16 bit WAV and encoded into other containers with the local ffmpeg.
+"""
+import os
+import wave
+import subprocess
+
+import numpy as np
+
+# Container -> ffmpeg audio codec options, WAV is written directly
+CODECS = {
+    "wav": None,
+    "flac": ["-c:a", "flac"],
+    "mkv": ["-c:a", "flac"],
+    "mp3": ["-c:a", "libmp3lame", "-b:a", "192k"],
+    "mp4": ["-c:a", "aac", "-b:a", "192k"],
+    "ogg": ["-c:a", "libvorbis", "-q:a", "6"],
+}
+
+_NEEDLE_LEVEL = 0.3
+_NOISE_LEVEL = 0.1
+
+
+def write_wav(path, samples, sr):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype("<i2").tobytes())
+
+
+def make_needle(length, sr, seed=0):
+    rng = np.random.default_rng(seed)
+    return (rng.standard_normal(int(length * sr)) * _NEEDLE_LEVEL).astype(np.float32)
+
+
+def make_haystack(needle, duration, offset, sr, seed):
+    rng = np.random.default_rng(seed)
+    samples = (rng.standard_normal(int(duration * sr)) * _NOISE_LEVEL).astype(np.float32)
+    start = int(offset * sr)
+    samples[start:start + len(needle)] += needle[:len(samples) - start]
+    return samples
+
+
+def encode(ffmpeg, source, target):
+    container = os.path.splitext(target)[1][1:]
+    command = [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", source, *CODECS[container], target]
+    process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not encode '{target}': {process.stderr.decode('utf-8').strip()}")
+
+
+def build(directory, ffmpeg, count, needle_length, duration, max_offset, container, sr=44100, seed=0):
+    """
+    Write a needle and ``count`` haystacks into ``directory``, reusing files an earlier call already wrote.
+
+    Offsets are drawn between 0 and ``max_offset`` seconds, so the needle lies within a window of that length.
+    Returns the needle's path and a list of ``(haystack path, offset)``.
+    """
+    if container not in CODECS:
+        raise ValueError(f"Unknown container '{container}', choose from {', '.join(CODECS)}.")
+    os.makedirs(directory, exist_ok=True)
+
+    needle = make_needle(needle_length, sr, seed)
+    needle_path = os.path.join(directory, f"needle_{needle_length}s.wav")
+    if not os.path.exists(needle_path):
+        write_wav(needle_path, needle, sr)
+
+    rng = np.random.default_rng(seed)
+    offsets = np.round(rng.uniform(0, max(max_offset - needle_length, 0), count), 2)
+
+    haystacks = []
+    for i, offset in enumerate(offsets):
+        name = f"haystack_{needle_length}s_{duration}s_{max_offset}s_{i}"
+        path = os.path.join(directory, f"{name}.{container}")
+        if not os.path.exists(path):
+            source = os.path.join(directory, f"{name}.wav")
+            if not os.path.exists(source):
+                write_wav(source, make_haystack(needle, duration, offset, sr, seed + i + 1), sr)
+            if container != "wav":
+                encode(ffmpeg, source, path)
+        haystacks.append((path, float(offset)))
+
+    return needle_path, haystacks
@@ -0,0 +1,80 @@
+"""
+Startup budget of the CLI.
+
+Runs ``aivd --version`` and ``aivd --dry-run`` in fresh interpreters and fails if the best of a few runs takes longer
+than its budget, or if a heavy library got imported although nothing is decoded or searched.
+
+    python benchmarks/startup.py [--runs N] [--ffmpeg PATH]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+# Wall clock budgets in seconds, interpreter start-up included
+BUDGETS = {
+    "version": 0.2,
+    "dry-run": 0.3,
+}
+# None of these are needed before the first file is decoded
+HEAVY_MODULES = ("numpy", "scipy", "librosa", "numba", "soundfile", "sklearn")
+
+
+def _imported(stderr):
+    modules = set()
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            modules.add(line.rsplit("|", 1)[1].strip().split(".")[0])
+    return modules
+
+
+def measure(args, runs):
+    best = None
+    modules = set()
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run([sys.executable, MAIN, *args], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            raise RuntimeError(f"'aivd {' '.join(args)}' exited with {process.returncode}")
+        best = elapsed if best is None else min(best, elapsed)
+
+    # Separate run for the import list, -X importtime itself slows the interpreter down
+    process = subprocess.run([sys.executable, "-X", "importtime", MAIN, *args], stdout=subprocess.DEVNULL,
+                             stderr=subprocess.PIPE, text=True)
+    modules |= _imported(process.stderr)
+
+    return best, sorted(modules & set(HEAVY_MODULES))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the CLI start-up time against its budget.")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per command, the best one counts.")
+    parser.add_argument("--ffmpeg", default=None, help="ffmpeg path for --dry-run, if it isn't on the system path.")
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        needle = os.path.join(directory, "needle.wav")
+        open(needle, "wb").close()
+        dry_run = [needle, directory, "--dry-run", "--silent", "-c", "1"]
+        if options.ffmpeg is not None:
+            dry_run.extend(["--ffmpeg", options.ffmpeg])
+
+        failed = False
+        for name, args in (("version", ["--version"]), ("dry-run", dry_run)):
+            best, heavy = measure(args, options.runs)
+            over = best > BUDGETS[name]
+            failed |= over or bool(heavy)
+            print(f"{name}: {best * 1000:.0f} ms (budget {BUDGETS[name] * 1000:.0f} ms)"
+                  f"{' OVER BUDGET' if over else ''}{', imports ' + ', '.join(heavy) if heavy else ''}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Throughput benchmark of ``Detector.run`` on synthetic media.
+
+Every combination of the given file counts, window sizes, needle lengths, thread counts, ffmpeg process counts, batch
+sizes and containers runs in a fresh interpreter, so peak RSS is measured per combination. The report lists the time
+spent in each stage, files per second, peak RSS, the offset accuracy against the known offsets, and the scaling
+efficiency relative to the fewest threads of an otherwise equal combination.
+
+``_convert`` walks the files on a thread of its own while ``_detect`` runs, so their times overlap. ``_convert`` ends
+once the last file is scheduled, and ``_detect`` ends once the last file is complete.
+
+    python benchmarks/throughput.py --files 8,32 --threads 1,2,4 --containers wav,mkv --output report.json
+    python benchmarks/throughput.py --files 256 --windows 10 --duration 10 --batch-sizes 1,8,32 --containers wav
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import itertools
+import subprocess
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Offsets are reported in hundredths of a second, lossy codecs add a little encoder delay on top
+_TOLERANCE = 0.05
+
+_DIMENSIONS = ("files", "window", "needle_length", "threads", "ffmpeg_processes", "batch_size", "container")
+
+
+def _timed_detector():
+    from detector import Detector
+
+    class TimedDetector(Detector):
+        def __init__(self, *args, **kwargs):
+            self.stages = {}
+            super().__init__(*args, **kwargs)
+
+        def _time(self, stage, method, *args):
+            start = time.perf_counter()
+            try:
+                return method(*args)
+            finally:
+                self.stages[stage] = time.perf_counter() - start
+
+        def _init(self):
+            return self._time("init", super()._init)
+
+        def _load(self):
+            return self._time("load", super()._load)
+
+        def _convert(self, ffmpeg_args=None):
+            return self._time("convert", super()._convert, ffmpeg_args)
+
+        def _detect(self, pool):
+            return self._time("detect", super()._detect, pool)
+
+    return TimedDetector
+
+
+def run_single(config):
+    """Run one combination in this process and return its measurements."""
+    from utils.logger import Logger
+
+    needle, haystacks = config["needle"], config["haystacks"]
+    offsets = dict(haystacks)
+
+    start = time.perf_counter()
+    with _timed_detector()([needle], [path for path, _ in haystacks], -1, config["window"], config["ffmpeg"],
+                           Logger(silent=True), config["threads"], config["ffmpeg_processes"],
+                           analysis_rate=config["analysis_rate"], batch_size=config["batch_size"]) as detector:
+        data = detector.run()
+        stages = dict(detector.stages)
+    total = time.perf_counter() - start
+
+    errors = [abs(matches[needle]["offset"] - offsets[file]) for file, matches in data.items()]
+    # ru_maxrss is in KiB on Linux, children covers the pool workers and ffmpeg
+    return {
+        "stages": {stage: round(seconds, 4) for stage, seconds in stages.items()},
+        "total": round(total, 4),
+        "files_per_second": round(len(haystacks) / total, 3),
+        "peak_rss_mb": {
+            "main": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+        },
+        "found": len(data),
+        "accuracy": round(sum(error <= _TOLERANCE for error in errors) / len(haystacks), 4),
+        "max_error": round(max(errors), 3) if errors else None,
+    }
+
+
+def _scaling(results):
+    groups = {}
+    for result in results:
+        key = tuple(result[dimension] for dimension in _DIMENSIONS if dimension != "threads")
+        groups.setdefault(key, []).append(result)
+
+    for group in groups.values():
+        base = min(group, key=lambda result: result["threads"])
+        for result in group:
+            if result is base:
+                result["scaling_efficiency"] = 1.0
+                continue
+            speedup = result["files_per_second"] / base["files_per_second"]
+            result["scaling_efficiency"] = round(speedup / (result["threads"] / base["threads"]), 3)
+
+
+def _ffmpeg_version(ffmpeg):
+    try:
+        return subprocess.check_output([ffmpeg, "-version"], text=True).splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        return None
+
+
+def _numbers(value):
+    return [int(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure Detector.run throughput on synthetic media.")
+    parser.add_argument("--files", type=_numbers, default=[8], help="Comma separated file counts.")
+    parser.add_argument("--windows", type=_numbers, default=[60], help="Comma separated window sizes in seconds.")
+    parser.add_argument("--needle-lengths", type=_numbers, default=[5],
+                        help="Comma separated needle lengths in seconds.")
+    parser.add_argument("--threads", type=_numbers, default=[1], help="Comma separated --threads values.")
+    parser.add_argument("--ffmpeg-processes", type=_numbers, default=[1],
+                        help="Comma separated --ffmpeg-processes values.")
+    parser.add_argument("--batch-sizes", type=_numbers, default=[1], help="Comma separated --batch-size values.")
+    parser.add_argument("--containers", type=lambda value: value.split(","), default=["wav", "mkv"],
+                        help="Comma separated containers, see benchmarks/media.py.")
+    parser.add_argument("--duration", type=int, default=120, help="Length of every haystack in seconds.")
+    parser.add_argument("--analysis-rate", type=int, default=8000, help="The --analysis-rate to run with.")
+    parser.add_argument("--ffmpeg", default="ffmpeg", help="The ffmpeg used for encoding and decoding.")
+    parser.add_argument("--media", default=None, help="Directory to keep the generated media in between runs.")
+    parser.add_argument("--output", default=None, help="Write the JSON report here instead of stdout.")
+    parser.add_argument("--config", default=None, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.config is not None:
+        print(json.dumps(run_single(json.loads(options.config))))
+        return
+
+    from benchmarks.media import build
+
+    ffmpeg = subprocess.check_output(["which", options.ffmpeg], text=True).strip() \
+        if os.sep not in options.ffmpeg else options.ffmpeg
+
+    with tempfile.TemporaryDirectory() as temp:
+        media = options.media or temp
+        results = []
+        for files, window, needle_length, threads, ffmpeg_processes, batch_size, container in itertools.product(
+                options.files, options.windows, options.needle_lengths, options.threads, options.ffmpeg_processes,
+                options.batch_sizes, options.containers):
+            config = {
+                "files": files,
+                "window": window,
+                "needle_length": needle_length,
+                "threads": threads,
+                "ffmpeg_processes": ffmpeg_processes,
+                "batch_size": batch_size,
+                "container": container,
+                "analysis_rate": options.analysis_rate,
+                "ffmpeg": ffmpeg,
+            }
+            print(f"Running {', '.join(f'{dimension}={config[dimension]}' for dimension in _DIMENSIONS)}...",
+                  file=sys.stderr)
+            # Media is generated here, so encoding counts towards neither the timings nor the measured peak RSS
+            config["needle"], config["haystacks"] = build(media, ffmpeg, files, needle_length, options.duration,
+                                                          window, container)
+
+            process = subprocess.run([sys.executable, os.path.abspath(__file__), "--config", json.dumps(config)],
+                                     stdout=subprocess.PIPE, text=True, cwd=ROOT)
+            if process.returncode != 0:
+                sys.exit(f"Benchmark run failed with exit code {process.returncode}.")
+
+            result = {dimension: config[dimension] for dimension in _DIMENSIONS}
+            result.update(json.loads(process.stdout.strip().splitlines()[-1]))
+            results.append(result)
+
+    _scaling(results)
+    report = json.dumps({
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "ffmpeg": _ffmpeg_version(ffmpeg),
+            "duration": options.duration,
+            "analysis_rate": options.analysis_rate,
+        },
+        "results": results
+    }, indent=2)
+
+    if options.output is not None:
+        with open(options.output, "w") as f:
+            f.write(report + "\n")
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,386 @@
 from __future__ import annotations
 
 import os
+import re
 import time
-import uuid
+import queue
 import threading
 import traceback
 import subprocess
 import multiprocessing
+from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor
 
-from utils import os_helpers
+from utils import os_helpers, metrics
 from utils.logger import Logger
 
 
-def _detector_thread(file_obj):
-    try:
-        load, correlate, argmax, y_find, sr, logger = file_obj["args"]
-    except KeyError:
-        return {"file": None, "offset": -1}
+# Seconds decoded around a fingerprint match to verify it
+_VERIFY_MARGIN = 1
+
+# The input's length in ffmpeg's log, "N/A" for streams without one
+_DURATION = re.compile(rb"Duration: (\d+):(\d{2}):(\d{2}(?:\.\d+)?)")
+
+# Per-process state of the detector pool, filled once by _init_detector
+_worker = {}
+
+
+def _init_detector(filter_class, filter_descriptor, sr, top, logger):
+    _worker["filter"] = filter_class.attach(filter_descriptor)
+    _worker["sr"] = sr
+    _worker["top"] = top
+    _worker["logger"] = logger
+
+
+def no_match():
+    return {"offset": -1, "score": None, "psr": None, "ratio": None}
+
+
+def ffmpeg_command(ffmpeg, file, start, end, sr, threads=1, additional_args=None, quiet=True):
+    """
+    The ffmpeg call decoding ``file`` from ``start`` to ``end`` seconds to raw mono float32 PCM on stdout.
+
+    A negative ``start`` decodes the last ``-start`` seconds of the file instead, ``end`` is ignored then. ffmpeg
+    still logs the input's duration for ``resolve_start``.
+    """
+    ffmpeg_opts = [ffmpeg, "-nostdin"]
+
+    if start < 0:
+        ffmpeg_opts.extend(["-loglevel", "info", "-nostats", "-hide_banner"] if quiet else ["-nostats"])
+    elif quiet:
+        ffmpeg_opts.extend(["-loglevel", "quiet"])
+
+    # Seeking before the input, so only the requested range is demuxed and decoded
+    if start < 0:
+        ffmpeg_opts.extend(["-sseof", str(start)])
+    elif start > 0:
+        ffmpeg_opts.extend(["-ss", str(start), "-t", str(end - start)])
+    else:
+        ffmpeg_opts.extend(["-to", str(end)])
+    ffmpeg_opts.extend(["-threads", str(threads), "-i", file])
+
+    if additional_args is not None:
+        ffmpeg_opts.extend(additional_args)
+
+    # Raw mono float32 PCM at the base file's sample rate, straight into memory
+    ffmpeg_opts.extend([
+        "-vn",
+        "-f", "f32le",
+        "-ac", "1",
+        "-ar", str(sr),
+        "pipe:1"
+    ])
+
+    return ffmpeg_opts
+
+
+def resolve_start(start, decoded, stderr):
+    """
+    The offset from the beginning of the file of a window ``ffmpeg_command`` decoded with a negative ``start``.
+
+    ``decoded`` is the window's length in seconds, the file's duration is read from ffmpeg's ``stderr``.
+    """
+    if start >= 0:
+        return start
+
+    match = _DURATION.search(stderr)
+    if match is not None:
+        hours, minutes, seconds = match.groups()
+        return round(max(int(hours) * 3600 + int(minutes) * 60 + float(seconds) + start, 0), 3)
+    # Without a duration, only a file shorter than the requested range is known to start at its beginning
+    if decoded < -start - 1:
+        return 0
+    raise ValueError("ffmpeg reported no duration, the offset can't be determined")
+
+
+class DecodeError(Exception):
+    """Raised by ``decode_window`` for a window that neither the WAV reader nor ffmpeg could decode."""
 
-    logger.debug(f"\tDetecting in '{file_obj['name']}'...")
+
+def read_wav(file, start, end, sr, logger):
+    """
+    Map a window of a plain WAV like ``decode_window`` decodes it, ``None`` if the file has to go through ffmpeg.
+
+    Returns ``(samples, start, end)`` with the window's range counted from the beginning of the file.
+    """
+    from utils.wav import read_window, duration
+
+    if start < 0:
+        try:
+            length = duration(file)
+        except Exception:
+            length = None
+        # Unmappable WAVs keep their tail range and go through ffmpeg
+        if length is None:
+            return None
+        start, end = round(max(length + start, 0), 3), length
 
     try:
-        y_within, _ = load(file_obj["location"], sr=sr)
-        c = correlate(y_within, y_find, mode='valid', method='fft')
-        peak = argmax(c)
-        offset = round(peak / sr, 2)
+        window = read_window(file, end - start, sr, start)
+    except Exception as e:
+        logger.debug(f"\tCould not map '{file}', falling back to ffmpeg: '{e}'")
+        return None
+    if window is None:
+        logger.debug(f"\tUnsupported WAV layout in '{file}', falling back to ffmpeg.")
+        return None
+    return window[0], start, end
 
-        logger.debug(f"\tDetected in '{file_obj['name']}' at {offset} seconds.")
+
+def decoded_samples(file, start, sr, returncode, stdout, stderr, logger):
+    """
+    The samples and start in seconds of a window ``ffmpeg_command`` decoded, from the process' exit code and output.
+
+    Raises ``DecodeError`` if ffmpeg failed.
+    """
+    from numpy import frombuffer
+
+    if returncode != 0:
+        raise DecodeError(f"Error decoding '{file}': '{stderr.decode('utf-8', 'replace').strip()}'")
+
+    samples = frombuffer(stdout, dtype="float32")
+    try:
+        start = resolve_start(start, len(samples) / sr, stderr)
+    except ValueError as e:
+        raise DecodeError(f"Could not locate the end of '{file}': '{e}'") from e
+    logger.debug(f"\tDecoded '{file}' ({len(samples)} samples).")
+    return samples, start
+
+
+def decode_window(file, start, end, sr, ffmpeg, threads=1, additional_args=None, timeout=None, cache=None,
+                  logger: Logger = None):
+    """
+    Decode ``file`` from ``start`` to ``end`` seconds to mono float32 at ``sr``, a negative ``start`` decodes the
+    last ``-start`` seconds instead.
+
+    Plain WAVs are read straight from disk, unless extra ffmpeg arguments could change the audio. Everything else is
+    looked up in the decode ``cache``, if given, and decoded by ffmpeg otherwise. Returns ``(samples, start, end,
+    source)`` with the window's range counted from the beginning of the file. Raises ``DecodeError`` if the window
+    can't be decoded.
+    """
+    logger = logger if logger is not None else Logger(silent=True)
+
+    if os_helpers.is_audio_file(file) and additional_args is None:
+        window = read_wav(file, start, end, sr, logger)
+        if window is not None:
+            samples, start, end = window
+            logger.debug(f"\tMapped '{file}' ({len(samples)} samples).")
+            return samples, start, end, "wav"
+
+    cache_key = None
+    # Tail windows are only located in the file once decoded, so they aren't cached
+    if cache is not None and start >= 0:
+        cache_key = cache.key(file, sr, start, end, additional_args)
+        samples = cache.get(cache_key)
+        if samples is not None:
+            logger.debug(f"\tLoaded '{file}' from cache ({len(samples)} samples).")
+            return samples, start, end, "cache"
+
+    if start < 0:
+        logger.debug(f"\tDecoding the last {-start} seconds of '{file}'...")
+    else:
+        logger.debug(f"\tDecoding '{file}' from {start} to {end} seconds...")
+
+    command = ffmpeg_command(ffmpeg, file, start, end, sr, threads, additional_args,
+                             not logger.is_debug or logger.is_silent)
+    try:
+        ffmpeg_process = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise DecodeError(f"Decoding '{file}' timed out after {timeout} seconds!")
+    except OSError as e:
+        raise DecodeError(f"Could not start ffmpeg '{ffmpeg}': '{e}'") from e
+    samples, start = decoded_samples(file, start, sr, ffmpeg_process.returncode, ffmpeg_process.stdout,
+                                     ffmpeg_process.stderr, logger)
+
+    if cache_key is not None:
+        cache.put(cache_key, samples)
+    return samples, start, end, "ffmpeg"
+
+
+def next_window(start, end, first, max_window, overlap, decoded):
+    """
+    The window to search after ``start`` to ``end`` seconds brought no confident match, or ``None`` if there is none.
+
+    Windows double in length from ``first`` on, up to ``max_window`` seconds. The next window overlaps the previous
+    one by ``overlap`` seconds, the longest needle, so a match across the previous end isn't missed. ``decoded`` is
+    the length of the previous window in seconds, a short decode means the end of the file was reached.
+    """
+    wider = first + min((end - first) * 2, max_window)
+    if wider <= end or decoded < end - start - 1:
+        return None
+    return max(end - overlap, first), wider
+
+
+def _detector_batch(file_objs):
+    return detect_windows(file_objs, _worker["filter"], _worker["sr"], _worker["top"], _worker["logger"])
+
+
+def detect_window(file_obj, matched_filter, sr, top, logger):
+    """
+    Search one decoded window, shared through ``utils.shared``, for all needles of ``matched_filter``.
+
+    Returns the window's duration, a match per needle with offsets in seconds from the start of the file
+    (``None`` where the needle is longer than the window), the window's fingerprint if requested and the timings of
+    the window so far plus this worker's.
+    """
+    return detect_windows([file_obj], matched_filter, sr, top, logger)[0]
+
+
+def detect_windows(file_objs, matched_filter, sr, top, logger):
+    """
+    Search several decoded windows at once, windows of equal length are correlated as one stack.
+
+    Returns a result per window, see ``detect_window``.
+    """
+    from utils.shared import attach_array, release
+
+    started = time.time()
+    windows = []
+    for file_obj in file_objs:
+        logger.debug(f"\tDetecting in '{file_obj['name']}'...")
+        window = dict(file_obj.get("timings", {}))
+        window["pid"] = os.getpid()
+        if "submitted" in file_obj:
+            window["pool_wait"] = max(started - file_obj["submitted"], 0.0)
+        windows.append(window)
+
+    shms = []
+    haystacks = []
+    fingerprints = [None] * len(file_objs)
+    try:
+        for file_obj, window in zip(file_objs, windows):
+            shm, samples = attach_array(file_obj["samples"])
+            shms.append(shm)
+            haystacks.append(samples)
+            window["samples"] = len(samples)
+        found = matched_filter.find_many(haystacks, top, windows)
+
+        for i, (file_obj, window) in enumerate(zip(file_objs, windows)):
+            if file_obj["fingerprint"]:
+                from utils.fingerprint import landmarks
+                fingerprinted = time.perf_counter()
+                fingerprints[i] = landmarks(haystacks[i], sr)
+                window["fingerprint"] = time.perf_counter() - fingerprinted
     except Exception as e:
-        logger.error(f"\tError detecting in '{file_obj['name']}': '{e}'", traceback.format_exc())
-        offset = -1
+        logger.error(f"\tError detecting in {', '.join(repr(file_obj['name']) for file_obj in file_objs)}: '{e}'",
+                     traceback.format_exc())
+        found = [[None] * len(matched_filter.needle_lengths) for _ in file_objs]
+    finally:
+        durations = [len(samples) / sr for samples in haystacks]
+        durations.extend([0] * (len(file_objs) - len(durations)))
+        # The mapped arrays have to go before their blocks can be closed
+        samples = haystacks = None
+        for shm in shms:
+            release(shm)
+
+    results = []
+    for file_obj, window, duration, matches, fingerprint in zip(file_objs, windows, durations, found, fingerprints):
+        # Needles longer than the decoded window can't be found in it
+        for i, match in enumerate(matches):
+            if match is None:
+                continue
+            matches[i] = {
+                "offset": round(file_obj["start"] + match["peak"] / sr, 2),
+                "score": round(match["score"], 3),
+                "psr": round(match["psr"], 2),
+                "ratio": None if match["ratio"] is None else round(match["ratio"], 2)
+            }
+            if "top" in match:
+                matches[i]["top"] = [round(file_obj["start"] + peak / sr, 2) for peak in match["top"]]
+
+        logger.debug(f"\tDetected in '{file_obj['name']}' at "
+                     f"{', '.join(str(-1 if match is None else match['offset']) for match in matches)} seconds.")
+        results.append({
+            "file": file_obj["name"],
+            "duration": duration,
+            "matches": matches,
+            "fingerprint": fingerprint,
+            "metrics": window
+        })
 
-    return {
-        "file": file_obj["name"],
-        "offset": offset
-    }
+    return results
 
 
 class Detector:
-    def __init__(self, base_file: str, files: list[str], time_: int, window: int, ffmpeg: str, logger: Logger,
-                 clean=True, aivd_threads=1, ffmpeg_processes=1):
-        self._base_file = base_file
+    def __init__(self, base_files: list[str], files: Iterable[str], time_: int, window: int, ffmpeg: str,
+                 logger: Logger, aivd_threads=1, ffmpeg_processes=1, cache_dir=None, cache_size=0, analysis_rate=0,
+                 max_window=None, min_confidence=10.0, top=0, fingerprint_index=None, ffmpeg_timeout=None, start=0,
+                 from_end=None, batch_size=1, collect_metrics=False):
+        self._base_files = base_files
         self._files = files
-        self.__ready_files, self.__to_convert = os_helpers.is_audio_files(files)
+        self.__ready_count = 0
+        self.__convert_count = 0
 
         self.__load = None
-        self.__correlate = None
-        self.__argmax = None
-
-        self._ffmpeg_semaphore = threading.Semaphore(ffmpeg_processes)
-        self._threads = aivd_threads
+        self.__matched_filter = None
+        self.__coarse_to_fine_filter = None
+        self.__share_array = None
+        self.__release = None
+        self.__decode_cache = None
+        self.__fingerprint = None
+
+        self._ffmpeg_processes = int(ffmpeg_processes)
+        self._threads = int(aivd_threads)
+        # Decoded windows handed to a detector process at once
+        self._batch_size = int(batch_size)
+        # Every ffmpeg process gets its share of the CPU threads instead of one decoder thread per core each
+        self._ffmpeg_threads = max(1, os_helpers.thread_count() // self._ffmpeg_processes)
+        self.ffmpeg_timeout = ffmpeg_timeout
+
+        # Decoded files waiting for a detector process, bounded so fast decoders can't outrun memory
+        self._decoded = queue.Queue(maxsize=self._threads * 2 * self._batch_size)
+        self._pending = threading.BoundedSemaphore(self._threads * 2)
+        # Files between being found and complete, the walk waits for a slot so large batches don't pile up
+        self._in_flight = threading.BoundedSemaphore(self._ffmpeg_processes + self._threads * 2 * self._batch_size)
 
         self.time = time_
         self.window = window
+        self.max_window = max_window if max_window is not None else window
+        # Windows count from start, or cover the last from_end seconds of every file without being widened
+        self.start = start
+        self.from_end = from_end
+        self.min_confidence = min_confidence
+        self.top = top
+        self.fingerprint_index = fingerprint_index
+        self.__index = None
+        # Offsets voted for by the fingerprint index per indexed file and base file
+        self.__candidates = {}
         self.ffmpeg = ffmpeg
         self.logger = logger
-        self.clean = clean
+        self.cache_dir = cache_dir
+        self.cache_size = cache_size
+        self.analysis_rate = analysis_rate
+        self.__cache = None
 
-        self.__y_find = None
+        self.__y_finds = []
         self.__sr = None
-
-        self.__converter_map = {}
+        self.__needle_duration = 0
+        self.__filter = None
+        self.__filter_shms = []
+        self.__filter_descriptor = None
+
+        # Shared memory blocks holding decoded files until their detection finishes
+        self.__shared = {}
+
+        self.__ffmpeg_args = None
+        self.__on_result = None
+        self.__decoder = None
+        self.__jobs = set()
+        self.__stopped = False
+
+        # Search state per file, files are complete once no further window has to be decoded
+        self.__progress = {}
+        # The walk over the files counts as outstanding until it has yielded every file
+        self.__remaining = 1
+        self.__progress_lock = threading.Lock()
 
         self._output_data = {}
+        # Timings and sizes per file, summed over its windows, kept once complete only if asked for
+        self.collect_metrics = collect_metrics
+        self.__metrics = {}
+        # Running totals of every complete file
+        self.__totals = {}
+        self.__wall = 0.0
 
         self._init()
 
@@ -74,54 +392,71 @@ class Detector:
             self.logger.error(f"The Application was terminated: {exc_type.__name__}")
         self.clean_up()
 
-    def __ffmpeg_thread(self, file, file_obj, additional_args=None):
-        self._ffmpeg_semaphore.acquire()
-        target = file_obj["location"]
-        self.logger.debug(f"\tConverting '{file}' to '{target}'...")
-
-        ffmpeg_opts = [self.ffmpeg, "-y"]
-
-        if not self.logger.is_debug or self.logger.is_silent:
-            ffmpeg_opts.extend(["-loglevel", "quiet"])
+    def __decoded(self, file, file_obj, samples, source):
+        if self.__stopped:
+            return
+        self.__shared[file], descriptor = self.__share_array(samples)
+        now = time.time()
+        self._decoded.put({
+            "name": file,
+            "start": file_obj["start"],
+            "fingerprint": file_obj["fingerprint"],
+            "samples": descriptor,
+            "queued": now,
+            "timings": {
+                "source": source,
+                "schedule_wait": file_obj["decode_started"] - file_obj["scheduled"],
+                "decode": now - file_obj["decode_started"]
+            }
+        })
+        file_obj["success"] = True
+        file_obj["complete"] = True
 
-        ffmpeg_opts.extend([
-            "-to", str(self.window),
-            "-i", file,
-            target
-        ])
+    def __decode_done(self, file, file_obj, job):
+        self.__jobs.discard(job)
+        if job.cancelled():
+            return
 
-        if additional_args is not None:
-            ffmpeg_opts.extend(additional_args)
+        error = job.exception()
+        if error is not None:
+            self.logger.error(f"\tError decoding '{file}': '{error}'",
+                              "".join(traceback.format_exception(type(error), error, error.__traceback__)))
 
-        ffmpeg = subprocess.Popen(
-            ffmpeg_opts,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-        )
-        ffmpeg.wait()
+        if not file_obj["complete"] and not self.__stopped:
+            file_obj["complete"] = True
+            self._decoded.put({
+                "name": file,
+                "samples": None
+            })
 
-        if ffmpeg.returncode == 0:
-            file_obj["success"] = True
-            self.logger.debug(f"\tConverted '{file}' to '{target}'.")
-        else:
-            self.logger.error(
-                f"\tError converting '{file}' to '{target}'!",
-                ffmpeg.stderr.read().decode('utf-8') + "\n" + ffmpeg.stdout.read().decode('utf-8')
+    def __decode(self, file, file_obj, additional_args=None):
+        file_obj["decode_started"] = time.time()
+        try:
+            samples, file_obj["start"], file_obj["end"], source = decode_window(
+                file, file_obj["start"], file_obj["end"], self.__sr, self.ffmpeg, self._ffmpeg_threads,
+                additional_args, self.ffmpeg_timeout, self.__cache, self.logger
             )
-
-        file_obj["complete"] = True
-        self._ffmpeg_semaphore.release()
+        except DecodeError as e:
+            self.logger.error(f"\t{e}")
+            return
+        self.__decoded(file, file_obj, samples, source)
 
     def _init(self):
         self.logger.info("Loading libraries...")
         try:
-            from numpy import argmax
-            from librosa import load
-            from scipy.signal import correlate
+            from utils.audio import load
+            from utils.correlation import MatchedFilter, CoarseToFineFilter
+            from utils.shared import share_array, release
+            from utils.cache import DecodeCache
+            from utils import fingerprint
 
             self.__load = load
-            self.__correlate = correlate
-            self.__argmax = argmax
+            self.__matched_filter = MatchedFilter
+            self.__coarse_to_fine_filter = CoarseToFineFilter
+            self.__share_array = share_array
+            self.__release = release
+            self.__decode_cache = DecodeCache
+            self.__fingerprint = fingerprint
         except Exception as e:
             self.logger.error(f"Error loading libraries: '{e}'")
             exit(1)
@@ -129,92 +464,338 @@ class Detector:
         self.logger.empty_line()
 
     def _load(self):
-        self.logger.info("Loading base file...")
+        self.logger.info(f"Loading {len(self._base_files)} base file{'s' if len(self._base_files) > 1 else ''}...")
+        for base_file in self._base_files:
+            try:
+                # The first base file sets the sample rate everything else is resampled or decoded to
+                y_find, sr = self.__load(base_file, sr=self.__sr, duration=self.time if self.time > 0 else None,
+                                         ffmpeg=self.ffmpeg)
+            except Exception as e:
+                self.logger.error(f"Error loading base file '{base_file}': '{e}'")
+                exit(2)
+            self.__sr = sr
+            self.__y_finds.append(y_find)
+            self.logger.debug(f"\tLoaded '{base_file}' ({len(y_find)} samples at {sr} Hz).")
+
+        self.__needle_duration = max(len(y_find) for y_find in self.__y_finds) / self.__sr
+
         try:
-            self.__y_find, self.__sr = self.__load(self._base_file, sr=None,
-                                                   duration=self.time if self.time > 0 else None)
+            if 0 < self.analysis_rate < self.__sr:
+                self.__filter = self.__coarse_to_fine_filter(self.__y_finds, self.__sr, self.analysis_rate)
+                self.logger.debug(f"\tSearching at {self.analysis_rate} Hz first, refining at {self.__sr} Hz.")
+            else:
+                self.__filter = self.__matched_filter(self.__y_finds)
+            self.__filter_shms, self.__filter_descriptor = self.__filter.share()
         except Exception as e:
-            self.logger.error(f"Error loading base file: '{e}'")
+            self.logger.error(f"Error preparing base files: '{e}'")
             exit(2)
-        self.logger.debug("Base file loaded.")
+        self.logger.debug(f"Base files loaded, FFT block size {self.__filter.block_size}.")
         self.logger.empty_line()
 
-    def _convert(self, ffmpeg_args=None):
-        if len(self.__to_convert) == 0:
-            self.logger.info("No files to convert. Skipping conversion...")
-            return
+        if self.fingerprint_index is not None:
+            self._lookup()
 
-        self.logger.info(f"Converting {len(self.__to_convert)} files...")
+    def _lookup(self):
+        self.logger.info("Looking up base files in the fingerprint index...")
+        try:
+            # All files are looked up in one pass over the index, so the walk has to finish first
+            self._files = list(self._files)
+            self.__index = self.__fingerprint.FingerprintIndex(self.fingerprint_index)
+            indexed = self.__index.indexed(self._files, self.window)
+
+            for i, y_find in enumerate(self.__y_finds):
+                hashes, anchors = self.__fingerprint.landmarks(y_find, self.__sr)
+                found = self.__index.query(hashes, anchors, indexed.values(), self.window)
+                for file, file_id in indexed.items():
+                    self.__candidates.setdefault(file, [None] * len(self.__y_finds))[i] = found.get(file_id)
+        except Exception as e:
+            self.logger.error(f"Error reading fingerprint index '{self.fingerprint_index}': '{e}'",
+                              traceback.format_exc())
+            exit(2)
 
-        for file in self.__to_convert:
-            file_obj = {
-                "location": f"/tmp/{uuid.uuid4().hex}.wav",
-                "success": False,
-                "complete": False
-            }
+        self.logger.debug(f"\t{len(self.__candidates)} of {len(self._files)} files are indexed, "
+                          f"{sum(any(found) for found in self.__candidates.values())} contain a candidate.")
+        self.logger.empty_line()
 
-            threading.Thread(
-                target=self.__ffmpeg_thread,
-                args=(file, file_obj, ffmpeg_args, )
-            ).start()
+    def __schedule(self, file, start, end, fingerprint=False):
+        file_obj = {
+            "start": start,
+            "end": end,
+            "fingerprint": fingerprint,
+            "success": False,
+            "complete": False,
+            "scheduled": time.time()
+        }
 
-            self.__converter_map[file] = file_obj
+        job = self.__decoder.submit(self.__decode, file, file_obj, self.__ffmpeg_args)
+        self.__jobs.add(job)
+        job.add_done_callback(lambda done: self.__decode_done(file, file_obj, done))
 
-        # Wait for all conversions to complete
-        while not all([self.__converter_map[file]["complete"] for file in self.__converter_map]):
-            time.sleep(.1)
+    def _convert(self, ffmpeg_args=None):
+        if self.cache_dir is not None:
+            try:
+                self.__cache = self.__decode_cache(self.cache_dir, self.cache_size, self.logger)
+                self.logger.debug(f"\tUsing decode cache in '{self.cache_dir}'.")
+            except OSError as e:
+                self.logger.error(f"Could not open cache directory '{self.cache_dir}': '{e}'")
+
+        self.logger.info("Converting and reading files as they are found...")
+        if self.from_end is not None:
+            self.logger.debug(f"\tSearching the last {self.from_end} seconds of every file.")
+        elif self.start > 0:
+            self.logger.debug(f"\tSearching from {self.start} seconds into every file.")
+        if self.max_window > self.window and self.from_end is None:
+            self.logger.debug(f"\tWidening windows up to {self.max_window} seconds below a confidence of "
+                              f"{self.min_confidence}.")
+
+        self.__ffmpeg_args = ffmpeg_args
+        try:
+            for file in self._files:
+                self.__start(file)
+        except Exception as e:
+            self.logger.error(f"Error listing files: '{e}'", traceback.format_exc())
+        finally:
+            self.__settle()
+
+    def __start(self, file):
+        self._in_flight.acquire()
+        if os_helpers.is_audio_file(file):
+            self.__ready_count += 1
+        else:
+            self.__convert_count += 1
+
+        with self.__progress_lock:
+            self.__remaining += 1
+        start, end = (-self.from_end, 0) if self.from_end is not None else (self.start, self.start + self.window)
+        self.__progress[file] = {
+            "start": start,
+            "end": end,
+            "detected": False,
+            "verify": False,
+            "best": [None] * len(self._base_files),
+            "metrics": {}
+        }
+
+        if file not in self.__candidates:
+            # Files missing from the index get fingerprinted from the first window
+            self.__schedule(file, start, end, self.__index is not None)
+        else:
+            self.__verify(file)
 
-        self.logger.debug("Conversions complete.")
-        self.logger.empty_line()
+    def __verify(self, file):
+        progress = self.__progress[file]
+        candidates = [offset for offset, _ in filter(None, self.__candidates[file])]
 
-    def _detect(self):
-        self.logger.info(f"Detecting in {len(self.__ready_files)} original files and {len(self.__converter_map)} "
-                         f"converted files...")
-        files = []
+        if not candidates:
+            self.logger.debug(f"\tNo fingerprint match in '{file}'.")
+            progress["detected"] = True
+            self.__complete(file)
+            return
 
-        for file in self.__ready_files:
-            files.append({
-                "name": file,
-                "location": file,
-            })
-        for file in self.__converter_map:
-            if not self.__converter_map[file]["success"]:
+        # Only the neighbourhood of the voted offsets is decoded and correlated to confirm them
+        progress["verify"] = True
+        progress["start"] = round(max(min(candidates) - _VERIFY_MARGIN, 0), 2)
+        progress["end"] = round(min(max(candidates) + self.__needle_duration + _VERIFY_MARGIN, self.window), 2)
+        self.logger.debug(f"\tVerifying fingerprint match in '{file}' between {progress['start']} and "
+                          f"{progress['end']} seconds.")
+        self.__schedule(file, progress["start"], progress["end"])
+
+    def __complete(self, file):
+        self._in_flight.release()
+        # Nothing is kept about a complete file but its result and metrics
+        progress = self.__progress.pop(file)
+        self.__candidates.pop(file, None)
+        # Files that never reached a detector process have nothing to count
+        if progress["metrics"]:
+            metrics.add_file(self.__totals, progress["metrics"])
+            if self.collect_metrics:
+                self.__metrics[file] = progress["metrics"]
+        if progress["detected"]:
+            matches = {
+                base_file: no_match() if match is None else match
+                for base_file, match in zip(self._base_files, progress["best"])
+            }
+            if self.__on_result is None:
+                self._output_data[file] = matches
+            else:
+                try:
+                    self.__on_result(file, matches)
+                except Exception as e:
+                    self.logger.error(f"\tCould not output the result of '{file}': '{e}'", traceback.format_exc())
+
+        self.__settle()
+
+    def __settle(self):
+        with self.__progress_lock:
+            self.__remaining -= 1
+            if self.__remaining == 0:
+                self._decoded.put(None)
+
+    def __widen(self, file, duration):
+        progress = self.__progress[file]
+        if progress["verify"] or self.from_end is not None:
+            return False
+        if all(match is not None and match["psr"] >= self.min_confidence for match in progress["best"]):
+            return False
+
+        window = next_window(progress["start"], progress["end"], self.start, self.max_window, self.__needle_duration,
+                             duration)
+        if window is None:
+            return False
+
+        self.logger.debug(f"\tNo confident match in '{file}' up to {progress['end']} seconds, widening to "
+                          f"{window[1]}.")
+        progress["start"], progress["end"] = window
+        self.__schedule(file, progress["start"], progress["end"])
+        return True
+
+    def __finished(self, file):
+        shm = self.__shared.pop(file, None)
+        if shm is not None:
+            self.__release(shm, unlink=True)
+
+    def __detected(self, file, result):
+        self.__finished(file)
+
+        if result["fingerprint"] is not None:
+            try:
+                self.__index.add(file, *result["fingerprint"], self.window)
+            except Exception as e:
+                self.logger.error(f"\tCould not add '{file}' to the fingerprint index: '{e}'")
+
+        progress = self.__progress[file]
+        metrics.add_window(progress["metrics"], result["metrics"])
+        progress["detected"] = True
+        for i, match in enumerate(result["matches"]):
+            # Base files the index found no trace of stay unmatched, the verification window isn't theirs
+            if progress["verify"] and self.__candidates[file][i] is None:
                 continue
-            files.append({
-                "name": file,
-                "location": self.__converter_map[file]["location"],
-                "args": (self.__load, self.__correlate, self.__argmax, self.__y_find, self.__sr, self.logger)
-            })
-
-        with multiprocessing.Pool(processes=self._threads) as pool:
-            self.logger.debug(f"\tUsing {self._threads} threads.")
-            results = pool.map(_detector_thread, files)
-
-        for result in results:
-            if result["file"] is None:
+            best = progress["best"][i]
+            if match is not None and (best is None or match["psr"] > best["psr"]):
+                progress["best"][i] = match
+
+        if not self.__widen(file, result["duration"]):
+            self.__complete(file)
+
+    def __detect_failed(self, file, error):
+        self.__finished(file)
+        self.logger.error(f"\tDetector process failed on '{file}': '{error}'")
+        self.__complete(file)
+
+    def __batch_detected(self, file_objs, results):
+        self._pending.release()
+        for file_obj, result in zip(file_objs, results):
+            self.__detected(file_obj["name"], result)
+
+    def __batch_failed(self, file_objs, error):
+        self._pending.release()
+        for file_obj in file_objs:
+            self.__detect_failed(file_obj["name"], error)
+
+    def __submit(self, pool, file_objs):
+        # Blocks while too many batches are already waiting on the pool
+        self._pending.acquire()
+        submitted = time.time()
+        for file_obj in file_objs:
+            file_obj["submitted"] = submitted
+            file_obj["timings"]["queue_wait"] = submitted - file_obj.pop("queued")
+        pool.apply_async(_detector_batch, (file_objs, ),
+                         callback=lambda results: self.__batch_detected(file_objs, results),
+                         error_callback=lambda error: self.__batch_failed(file_objs, error))
+
+    def __batch(self, file_obj):
+        # Whatever else is decoded already joins the batch, nothing waits for a batch to fill up
+        batch = [file_obj]
+        while len(batch) < self._batch_size:
+            try:
+                file_obj = self._decoded.get_nowait()
+            except queue.Empty:
+                break
+            if file_obj is None:
+                self._decoded.put(None)
+                break
+            if file_obj["samples"] is None:
+                self.__complete(file_obj["name"])
+                continue
+            batch.append(file_obj)
+
+        return batch
+
+    def _detect(self, pool):
+        self.logger.info("Detecting in files as they are decoded...")
+        self.logger.debug(f"\tUsing {self._threads} threads.")
+        if self._batch_size > 1:
+            self.logger.debug(f"\tSearching up to {self._batch_size} windows per batch.")
+
+        # Hand every window to the pool as soon as its decode finishes, until every file is complete
+        while self.__remaining > 0:
+            file_obj = self._decoded.get()
+            if file_obj is None:
+                break
+            if file_obj["samples"] is None:
+                self.__complete(file_obj["name"])
                 continue
-            self._output_data[result["file"]] = result["offset"]
+            self.__submit(pool, self.__batch(file_obj))
 
+        pool.close()
+        pool.join()
+
+        self.logger.debug(f"Conversions complete, read {self.__ready_count} audio files and converted "
+                          f"{self.__convert_count} files.")
         self.logger.debug("Detection complete.")
         self.logger.empty_line()
 
     def clean_up(self):
-        if not self.clean:
-            self.logger.debug("Skipping clean up.")
-            return
-
         self.logger.info("Cleaning up...")
-        for file in self.__converter_map:
-            file = self.__converter_map[file]["location"]
-            if os.path.exists(file):
-                os.remove(file)
-                self.logger.debug(f"\tRemoved '{file}'")
+        self.__stopped = True
+        if self.__decoder is not None:
+            for job in list(self.__jobs):
+                job.cancel()
+            self.__decoder.shutdown(wait=False)
+        while not self._decoded.empty():
+            self._decoded.get_nowait()
+        for file in list(self.__shared):
+            self.__release(self.__shared.pop(file), unlink=True)
+        while self.__filter_shms:
+            self.__release(self.__filter_shms.pop(), unlink=True)
+        if self.__index is not None:
+            self.__index.close()
+            self.__index = None
         self.logger.debug("Clean up complete.")
         self.logger.empty_line()
 
-    def run(self, ffmpeg_args=None):
+    @property
+    def metrics(self):
+        """
+        Per-file and batch timings of the last ``run``, see ``utils.metrics.summarise``.
+
+        Per-file timings are only kept with ``collect_metrics``, the batch totals always are.
+        """
+        return metrics.summarise(self.__metrics, self.__wall, self.__totals)
+
+    def run(self, ffmpeg_args=None, on_result=None):
+        """
+        Search every file and return ``{file: {base file: match}}``.
+
+        With ``on_result``, every file's matches are passed to ``on_result(file, matches)`` as soon as the file is
+        complete instead, from whichever thread completed it, and the returned mapping stays empty.
+        """
+        self.__on_result = on_result
+        started = time.perf_counter()
         self._load()
-        self._convert(ffmpeg_args)
-        self._detect()
+
+        # The pool is forked before any ffmpeg thread starts, workers map the needle spectrum once on start-up
+        with multiprocessing.Pool(processes=self._threads, initializer=_init_detector,
+                                  initargs=(type(self.__filter), self.__filter_descriptor, self.__sr, self.top,
+                                            self.logger)) as pool:
+            # A fixed set of decoder threads, each running at most one ffmpeg process at a time
+            self.__decoder = ThreadPoolExecutor(max_workers=self._ffmpeg_processes, thread_name_prefix="ffmpeg")
+            # Files are scheduled while the directory is still being walked, detection starts with the first one
+            walker = threading.Thread(target=self._convert, args=(ffmpeg_args, ), daemon=True)
+            walker.start()
+            self._detect(pool)
+            walker.join()
+            self.__decoder.shutdown()
+        self.__wall = time.perf_counter() - started
 
         return self._output_data
@@ -0,0 +1,69 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from detector import decode_window
+from utils.logger import Logger
+
+
+def _fingerprint(file, start, window, from_end, ffmpeg):
+    from numpy import int32
+    from utils.fingerprint import FINGERPRINT_RATE, landmarks
+
+    start, end = (-from_end, 0) if from_end is not None else (start, start + window)
+    samples, offset, _, _ = decode_window(file, start, end, FINGERPRINT_RATE, ffmpeg)
+    hashes, anchors = landmarks(samples, FINGERPRINT_RATE)
+    # Hashes fit in 32 bits and anchors are frames of a single window, halving what every file keeps in memory
+    return hashes.astype(int32), anchors.astype(int32), offset
+
+
+def discover(files, window=300, start=0, from_end=None, ffmpeg=None, processes=1, min_share=0.5, min_length=5.0,
+             logger: Logger = None):
+    """
+    Find the longest audio segment most of ``files`` share, without an input file to search for.
+
+    The searched range of every file is fingerprinted once on a pool of ``processes`` workers, then every file is
+    aligned against a few reference files by its landmark hashes. Returns ``None`` if no segment of at least
+    ``min_length`` seconds is shared by ``min_share`` of the files, otherwise a dict with the segment (the file it
+    was taken from, its start and duration in seconds and how many files share it) and per file the segment's
+    offset in seconds and the landmarks voting for it, offset ``-1`` where it wasn't found.
+    """
+    from utils.segments import discover as find_segment
+
+    logger = logger if logger is not None else Logger(silent=True)
+    files = list(files)
+
+    fingerprints = {}
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(_fingerprint, file, start, window, from_end, ffmpeg): file for file in files}
+        for future in as_completed(futures):
+            file = futures[future]
+            try:
+                fingerprints[file] = future.result()
+            except Exception as e:
+                logger.error(f"Error fingerprinting '{file}': '{e}'")
+                continue
+            logger.debug(f"Fingerprinted '{file}': {len(fingerprints[file][0])} landmarks.")
+
+    # Walk order, so the reference files don't depend on which worker finished first
+    names = [file for file in files if file in fingerprints]
+    logger.info(f"Looking for a segment shared by {len(names)} files...")
+    result = find_segment([fingerprints[file][:2] for file in names], min_share, min_length)
+    if result is None:
+        return None
+
+    reference = names[result["reference"]]
+    offsets = {}
+    for file, found in zip(names, result["offsets"]):
+        if found is None:
+            offsets[file] = {"offset": -1, "votes": 0}
+        else:
+            offsets[file] = {"offset": round(found[0] + fingerprints[file][2], 2), "votes": found[1]}
+
+    return {
+        "segment": {
+            "file": reference,
+            "start": round(result["start"] + fingerprints[reference][2], 2),
+            "duration": round(result["duration"], 2),
+            "files": sum(found is not None for found in result["offsets"])
+        },
+        "files": offsets
+    }
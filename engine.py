@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+import os
+import atexit
+import asyncio
+import importlib
+import subprocess
+from collections import OrderedDict
+from multiprocessing import resource_tracker
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterable, Iterable, Union
+
+from detector import DecodeError, decoded_samples, detect_window, ffmpeg_command, next_window, no_match, read_wav
+from utils import os_helpers
+from utils.logger import Logger
+
+# Needle filters a worker process keeps mapped between jobs
+_WORKER_FILTERS = 8
+
+# Per-process filters of the engine pool, most recently used last
+_worker_filters = OrderedDict()
+
+_default_engine = None
+
+
+class DetectionError(Exception):
+    """Raised by the engine where the CLI would exit, e.g. for a needle that can't be loaded or a failed decode."""
+
+
+def _engine_task(key, filter_class, filter_descriptor, sr, top, logger, file_obj):
+    from utils.shared import release
+
+    matched_filter = _worker_filters.get(key)
+    if matched_filter is None:
+        matched_filter = _worker_filters[key] = filter_class.attach(filter_descriptor)
+        if len(_worker_filters) > _WORKER_FILTERS:
+            _, evicted = _worker_filters.popitem(last=False)
+            shms = evicted._shm
+            del evicted
+            for shm in shms:
+                release(shm)
+    _worker_filters.move_to_end(key)
+
+    return detect_window(file_obj, matched_filter, sr, top, logger)
+
+
+def _warm_worker():
+    # Pay for the scientific imports once per worker instead of on its first job
+    import utils.correlation
+    import utils.shared
+
+
+def _release_loaded(ready):
+    from utils.shared import release
+
+    if not ready.cancelled() and ready.exception() is None:
+        for shm in ready.result()["shms"]:
+            release(shm, unlink=True)
+
+
+async def _iterate(paths):
+    if hasattr(paths, "__aiter__"):
+        async for path in paths:
+            yield path
+    else:
+        for path in paths:
+            yield path
+
+
+class Engine:
+    """
+    Long-lived detector for asyncio applications.
+
+    Loaded needles stay in shared memory and correlation runs on a process pool that every call reuses, so only
+    the first search pays for starting workers and preparing a needle. Windows are decoded by ffmpeg subprocesses
+    awaited on the event loop, at most ``ffmpeg_processes`` at a time over every search running on the engine, and
+    plain WAVs and needles are read on a small thread pool of the engine's own. Failures raise ``DetectionError``
+    instead of exiting the interpreter.
+    """
+
+    def __init__(self, processes=None, ffmpeg=None, ffmpeg_processes=1, logger: Logger = None, needle_cache=8):
+        self.processes = int(processes or max(1, os_helpers.thread_count() // 2))
+        self.ffmpeg = ffmpeg
+        self.ffmpeg_processes = int(ffmpeg_processes)
+        self.logger = logger if logger is not None else Logger(silent=True)
+        self.needle_cache = needle_cache
+
+        self._pool = None
+        # Needle loads and WAV reads, kept off the event loop and out of the application's default executor
+        self._io_pool = None
+        # Decodes running at once over every search, bound to the loop it was created on
+        self._decodes = None
+        self._decodes_loop = None
+        # Prepared needle filters by needle files and parameters, most recently used last
+        self._needles = OrderedDict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        # Without waiting, close() may run on the event loop and a worker may still be busy with a search being torn
+        # down
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        if self._io_pool is not None:
+            self._io_pool.shutdown(wait=False)
+            self._io_pool = None
+        while self._needles:
+            _, entry = self._needles.popitem()
+            if entry["ready"].done():
+                _release_loaded(entry["ready"])
+            else:
+                # Still loading for a search that is being torn down, unlinked once the load completes
+                entry["ready"].add_done_callback(_release_loaded)
+
+    async def warm(self):
+        """Start every worker process and do the heavy imports ahead of the first search."""
+        loop = asyncio.get_running_loop()
+        pool = self._executor()
+        await asyncio.gather(*(loop.run_in_executor(pool, _warm_worker) for _ in range(self.processes)))
+        # Only once the workers are forked, a worker forked during an import inherits a held import lock and hangs
+        await loop.run_in_executor(self._io_executor(), importlib.import_module, "utils.audio")
+
+    def _executor(self):
+        if self._pool is None:
+            # Workers forked before the first shared block would start resource trackers of their own, which then
+            # report every block the engine unlinks as leaked
+            resource_tracker.ensure_running()
+            self._pool = ProcessPoolExecutor(max_workers=self.processes)
+        return self._pool
+
+    def _io_executor(self):
+        if self._io_pool is None:
+            # A thread per concurrent decode plus one for a needle load
+            self._io_pool = ThreadPoolExecutor(max_workers=self.ffmpeg_processes + 1)
+        return self._io_pool
+
+    def _decode_slots(self):
+        """The semaphore every search of this engine decodes under, ``ffmpeg_processes`` slots on the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._decodes is None or self._decodes_loop is not loop:
+            self._decodes = asyncio.Semaphore(self.ffmpeg_processes)
+            self._decodes_loop = loop
+        return self._decodes
+
+    def _load(self, needles, time_, analysis_rate):
+        from utils.audio import load
+        from utils.correlation import MatchedFilter, CoarseToFineFilter
+
+        sr = None
+        y_finds = []
+        for needle in needles:
+            try:
+                # The first needle sets the sample rate everything else is resampled or decoded to
+                y_find, sr = load(needle, sr=sr, duration=time_ if time_ > 0 else None, ffmpeg=self.ffmpeg)
+            except Exception as e:
+                raise DetectionError(f"Could not load needle '{needle}': {e}") from e
+            y_finds.append(y_find)
+
+        if 0 < analysis_rate < sr:
+            matched_filter = CoarseToFineFilter(y_finds, sr, analysis_rate)
+        else:
+            matched_filter = MatchedFilter(y_finds)
+        shms, descriptor = matched_filter.share()
+
+        return {
+            "class": type(matched_filter),
+            "shms": shms,
+            "descriptor": descriptor,
+            "sr": sr,
+            "duration": max(len(y_find) for y_find in y_finds) / sr
+        }
+
+    async def _acquire(self, needles, time_, analysis_rate):
+        try:
+            stats = [os.stat(needle) for needle in needles]
+        except OSError as e:
+            raise DetectionError(f"Could not read needle: {e}") from e
+        key = repr((tuple(os.path.abspath(needle) for needle in needles),
+                    tuple((stat.st_size, stat.st_mtime_ns) for stat in stats), time_, analysis_rate))
+
+        entry = self._needles.get(key)
+        if entry is None:
+            self.logger.debug(f"Preparing needle{'s' if len(needles) > 1 else ''} "
+                              f"{', '.join(repr(needle) for needle in needles)}...")
+            # Registered before the first await, concurrent searches for the same needles wait for this one load
+            loading = asyncio.get_running_loop().run_in_executor(self._io_executor(), self._load, needles, time_,
+                                                                 analysis_rate)
+            entry = self._needles[key] = {"key": key, "users": 0, "ready": asyncio.ensure_future(loading)}
+        self._needles.move_to_end(key)
+        entry["users"] += 1
+        self._evict()
+
+        try:
+            # Shielded, a cancelled search must not cancel the load other searches wait for
+            loaded = await asyncio.shield(entry["ready"])
+        except BaseException:
+            entry["users"] -= 1
+            if entry["ready"].done() and entry["ready"].exception() is not None and self._needles.get(key) is entry:
+                del self._needles[key]
+            raise
+        entry.update(loaded)
+        return entry
+
+    def _evict(self):
+        """Unlink the least recently used needles beyond the cache size that no search holds on to."""
+        idle = [key for key, entry in self._needles.items() if entry["users"] == 0 and entry["ready"].done()]
+        for key in idle[:max(0, len(self._needles) - self.needle_cache)]:
+            _release_loaded(self._needles.pop(key)["ready"])
+
+    async def _decode(self, file, start, end, sr, decodes, ffmpeg_args, ffmpeg_timeout):
+        """Decode a window and return its samples and where it starts, a negative ``start`` counts from the end."""
+        if self.ffmpeg is None:
+            try:
+                self.ffmpeg = os_helpers.find_ffmpeg()
+            except (OSError, subprocess.CalledProcessError) as e:
+                raise DetectionError("ffmpeg not found on the system path.") from e
+
+        async with decodes:
+            if os_helpers.is_audio_file(file) and ffmpeg_args is None:
+                window = await asyncio.get_running_loop().run_in_executor(
+                    self._io_executor(), read_wav, file, start, end, sr, self.logger
+                )
+                if window is not None:
+                    return window[0], window[1]
+
+            command = ffmpeg_command(self.ffmpeg, file, start, end, sr,
+                                     max(1, os_helpers.thread_count() // self.ffmpeg_processes), ffmpeg_args)
+            try:
+                process = await asyncio.create_subprocess_exec(*command, stdin=subprocess.DEVNULL,
+                                                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except OSError as e:
+                raise DetectionError(f"Could not start ffmpeg '{self.ffmpeg}': '{e}'") from e
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), ffmpeg_timeout)
+            except asyncio.TimeoutError:
+                raise DetectionError(f"Decoding '{file}' timed out after {ffmpeg_timeout} seconds!")
+            finally:
+                # Timed out or the search was cancelled, don't leave ffmpeg running
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+        try:
+            return decoded_samples(file, start, sr, process.returncode, stdout, stderr, self.logger)
+        except DecodeError as e:
+            raise DetectionError(str(e)) from e
+
+    async def _correlate(self, entry, file, start, samples, top):
+        from utils.shared import share_array, release
+
+        shm, descriptor = share_array(samples)
+        try:
+            file_obj = {"name": file, "start": start, "fingerprint": False, "samples": descriptor}
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor(), _engine_task, entry["key"], entry["class"], entry["descriptor"], entry["sr"], top,
+                self.logger, file_obj
+            )
+        finally:
+            release(shm, unlink=True)
+
+    async def _search(self, entry, needles, file, decodes, window, max_window, min_confidence, top, ffmpeg_args,
+                      ffmpeg_timeout, first, from_end):
+        best = [None] * len(needles)
+        start, end = (-from_end, 0) if from_end is not None else (first, first + window)
+        try:
+            while True:
+                samples, offset = await self._decode(file, start, end, entry["sr"], decodes, ffmpeg_args,
+                                                     ffmpeg_timeout)
+                result = await self._correlate(entry, file, offset, samples, top)
+                for i, match in enumerate(result["matches"]):
+                    if match is not None and (best[i] is None or match["psr"] > best[i]["psr"]):
+                        best[i] = match
+
+                # Widen like the CLI does, until every needle is confident or the file ends
+                if from_end is not None:
+                    break
+                if all(match is not None and match["psr"] >= min_confidence for match in best):
+                    break
+                window = next_window(start, end, first, max_window, entry["duration"], result["duration"])
+                if window is None:
+                    break
+                start, end = window
+        except DetectionError as e:
+            return {"file": file, "matches": None, "error": str(e)}
+
+        return {
+            "file": file,
+            "matches": {needle: no_match() if match is None else match for needle, match in zip(needles, best)},
+            "error": None
+        }
+
+    async def detect_stream(self, needles: Union[str, list[str]], paths: Union[Iterable[str], AsyncIterable[str]],
+                            time_=-1, window=60, max_window=None, min_confidence=10.0, analysis_rate=8000, top=0,
+                            ffmpeg_args: list[str] = None, ffmpeg_timeout=None, start=0, from_end=None):
+        """
+        Search every file of ``paths`` for the ``needles`` and yield a result per file as soon as it is complete.
+
+        Results are ``{"file", "matches", "error"}`` dicts, ``matches`` maps each needle to a match like the CLI's
+        json output, or is ``None`` with the reason in ``error`` when the file could not be decoded. ``paths`` may be
+        an iterable or an async iterable, files are searched while it is still being consumed.
+
+        Windows count from ``start`` seconds into every file. ``from_end`` searches the last that many seconds of every
+        file instead in a single window, so it can't be combined with a ``max_window`` wider than ``window``. Offsets
+        are always from the beginning of the file.
+        """
+        if isinstance(needles, str):
+            needles = [needles]
+        if len(needles) == 0:
+            raise ValueError("At least one needle is required.")
+        if time_ != -1 and time_ <= 0:
+            raise ValueError("Time must be greater than 0.")
+        if window <= 0:
+            raise ValueError("Window must be greater than 0.")
+        max_window = max_window if max_window is not None else window
+        if max_window < window:
+            raise ValueError("Max window must not be smaller than the window.")
+        if start < 0:
+            raise ValueError("Start must not be negative.")
+        if from_end is not None and from_end <= 0:
+            raise ValueError("From end must be greater than 0.")
+        if from_end is not None and max_window > window:
+            raise ValueError("From end searches a single window, it can't be combined with a wider max window.")
+
+        entry = await self._acquire(needles, time_, analysis_rate)
+        decodes = self._decode_slots()
+        # Files searched at once, enough to keep ffmpeg and every worker busy
+        limit = self.ffmpeg_processes + self.processes * 2
+
+        pending = set()
+        try:
+            async for path in _iterate(paths):
+                if len(pending) >= limit:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        yield task.result()
+                pending.add(asyncio.ensure_future(self._search(entry, needles, path, decodes, window, max_window,
+                                                               min_confidence, top, ffmpeg_args, ffmpeg_timeout,
+                                                               start, from_end)))
+
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+            entry["users"] -= 1
+
+
+def default_engine():
+    """The engine shared by module level ``detect_stream`` calls, closed when the interpreter exits."""
+    global _default_engine
+    if _default_engine is None:
+        _default_engine = Engine()
+        atexit.register(_default_engine.close)
+    return _default_engine
+
+
+async def detect_stream(needles, paths, **options):
+    """``Engine.detect_stream`` on the shared default engine, see there for the options."""
+    async for result in default_engine().detect_stream(needles, paths, **options):
+        yield result
@@ -1,19 +1,99 @@
+import sys
 import json
+import shlex
 import click
 import os.path
+import itertools
+import threading
 
 from colorama import Fore, Style
 
-from detector import Detector
-
 from utils import os_helpers
 from utils.logger import Logger
 
 __version__ = "2.1.4"
 
+_RESULTS_DB = os.path.join(os.path.expanduser("~"), ".cache", "aivd", "results.db")
+_SOCKET = os.path.join(os.path.expanduser("~"), ".cache", "aivd", "aivd.sock")
 _PERMITTED_EXTENSIONS = ["mp4", "mkv", "avi", "mov", "wmv", "mp3", "wav", "flac", "ogg", "m4a", "wma"]
 
 
+def _changed_files(files, store, needles, previous, searched, emit=None):
+    """
+    Yield the files missing a stored result for any input file, collecting the stored results of all others.
+
+    With ``emit``, stored results are passed to it right away instead and nothing is collected.
+    """
+    for file in files:
+        matches = {input_file: store.get(key, file) for input_file, key in needles.items()}
+        if emit is not None:
+            if all(match is not None for match in matches.values()):
+                emit(file, matches)
+            else:
+                yield file
+            continue
+
+        searched.append(file)
+        if all(match is not None for match in matches.values()):
+            previous[file] = matches
+        else:
+            yield file
+
+
+def _line_writer(input_files):
+    """A thread safe callback writing and flushing one JSON line per searched file."""
+    lock = threading.Lock()
+
+    def emit(file, matches):
+        if len(input_files) == 1:
+            line = {"file": file, "match": matches[input_files[0]]}
+        else:
+            line = {"file": file, "matches": matches}
+        with lock:
+            click.echo(json.dumps(line))
+
+    return emit
+
+
+def _submit(socket_path, input_files, files, logger, options, on_result=None):
+    from server import submit, ServerError
+
+    logger.info(f"Sending {len(files)} files to the server at '{socket_path}'...")
+    # The server may run in another directory, paths are sent absolute and mapped back for the output
+    needles = {os.path.abspath(input_file): input_file for input_file in input_files}
+    paths = {os.path.abspath(file): file for file in files}
+
+    data = {}
+    try:
+        for result in submit(socket_path, list(needles), list(paths), options):
+            if result["error"] is not None:
+                logger.error(f"\t{result['error']}")
+                continue
+            matches = {needles[needle]: match for needle, match in result["matches"].items()}
+            if on_result is not None:
+                on_result(paths[result["file"]], matches)
+            else:
+                data[paths[result["file"]]] = matches
+    except (OSError, ValueError, ServerError) as e:
+        logger.error(f"Error running the search on the server: '{e}'")
+        exit(2)
+    logger.empty_line()
+
+    return data
+
+
+def _echo_text(data):
+    for file, matches in data.items():
+        click.echo(f"{Fore.RESET}{file.split('/').pop()} {Fore.CYAN}({Fore.WHITE}{file}{Fore.CYAN})")
+        if "offset" in matches:
+            matches = {None: matches}
+        for input_file, match in matches.items():
+            score = "" if match["score"] is None else f" {Fore.WHITE}(score {match['score']})"
+            source = "" if input_file is None else f" {Fore.CYAN}({Fore.WHITE}{input_file}{Fore.CYAN})"
+            click.echo(f"\t{Fore.GREEN}-> {Fore.RESET}{match['offset']}{Fore.WHITE}s {Fore.RESET}offset"
+                       f"{score}{source}{Style.RESET_ALL}")
+
+
 def print_version(ctx, _param, value):
     if not value or ctx.resilient_parsing:
         return
@@ -24,13 +104,18 @@ def print_version(ctx, _param, value):
 def load_legacy(ctx, _param, value):
     if not value or ctx.resilient_parsing:
         return
-    from legacy.main import main as legacy_main
+    try:
+        from legacy.main import main as legacy_main
+    except ImportError as e:
+        Logger().error(f"The legacy CLI needs librosa, install it with 'pip3 install -r requirements-legacy.txt': "
+                       f"'{e}'")
+        exit(-1)
     legacy_main()
     ctx.exit()
 
 
 @click.command()
-@click.argument("input_file", type=click.Path(exists=True), metavar="INPUT_FILE")
+@click.argument("input_files", nargs=-1, required=True, type=click.Path(exists=True), metavar="INPUT_FILE...")
 @click.argument("directory", type=click.Path(exists=True), metavar="DIRECTORY")
 @click.option("-r", "--recursive", is_flag=True, help="Search recursively in the specified directory.")
 @click.option("-e", "--extension", type=str, default=','.join(_PERMITTED_EXTENSIONS),
@@ -42,18 +127,76 @@ def load_legacy(ctx, _param, value):
                                                                   "to search for. Default is the whole audio file.")
 @click.option("-w", "--window", type=int, default=60, help="The window size in seconds to search for the audio file. "
                                                            "Default is 60 seconds.")
-@click.option("-f", "--format", "format_", type=click.Choice(["json", "txt", "raw"]), default="txt",
-              help="The output format. Default is TEXT.")
+@click.option("--max-window", type=int, default=None,
+              help="Widen the window step by step up to this many seconds for files without a confident match. "
+                   "Default is the window size, meaning the window is never widened.")
+@click.option("--start", type=float, default=0,
+              help="Start searching this many seconds into every file, only the searched range is decoded. "
+                   "Default is 0.")
+@click.option("--end", type=float, default=None,
+              help="Stop searching this many seconds into every file, instead of a window's length after --start. "
+                   "Default is the window size.")
+@click.option("--from-end", type=float, default=None,
+              help="Search the last FROM_END seconds of every file instead, for example for end credits. "
+                   "Default is searching from --start.")
+@click.option("--min-confidence", type=float, default=10.0,
+              help="The peak-to-sidelobe ratio a match needs to stop widening the window. Default is 10.")
+@click.option("--analysis-rate", type=int, default=8000,
+              help="The sample rate in Hz to run a first coarse search at, before refining the best matches at the "
+                   "input file's sample rate. 0 searches at the full sample rate only. Default is 8000 Hz.")
+@click.option("-k", "--top", type=int, default=0,
+              help="Also list the offsets of the best TOP matches per file in the json and raw output. "
+                   "Default is 0, meaning only the best match.")
+@click.option("-f", "--format", "format_", type=click.Choice(["json", "jsonl", "txt", "raw"]),
+              default="txt", help="The output format, JSONL writes every file's result as soon as it is found. Default "
+                                  "is TEXT.")
+@click.option("--metrics", "with_metrics", is_flag=True,
+              help="Add a 'metrics' section with per-file and total timings to the json and raw output.")
+@click.option("--metrics-file", type=click.Path(dir_okay=False), default=None,
+              help="Write per-file and total timings to this file. Default is no file.")
+@click.option("--metrics-format", type=click.Choice(["jsonl", "prometheus"]), default="jsonl",
+              help="The format of the --metrics-file. Default is JSONL.")
 @click.option("-c", "--threads", type=int, default=lambda: os_helpers.thread_count() / 2,
               help="The number of CPU threads to use. Default is half the number of CPU cores. The number is used for "
                    "both the audio file conversion via ffmpeg and the audio file search.")
+@click.option("--batch-size", type=int, default=1,
+              help="The most decoded windows searched together in one go, equally long windows are correlated as one "
+                   "stack. Larger batches help with many short files but keep more windows in memory. Default is 1.")
 @click.option("--ffmpeg", type=click.Path(exists=True), default=lambda: os_helpers.find_ffmpeg(),
               help="The path to the ffmpeg executable. Default is the system path.")
 @click.option("--ffmpeg-processes", type=int, default=1, help="The number of ffmpeg processes to run at the same time."
                                                               "Default is 1.")
+@click.option("--ffmpeg-timeout", type=float, default=None,
+              help="Seconds a single ffmpeg process may run before it is stopped and the file reported as failed. "
+                   "Default is no timeout.")
 @click.option("--ffmpeg-args", type=str, default=None, help="Additional arguments to pass to ffmpeg."
                                                             "Best pass them in quotes.")
-@click.option("--no-clean", is_flag=True, help="Do not clean up temporary files.")
+@click.option("--cache-dir", type=click.Path(file_okay=False), default=None,
+              help="Directory to cache decoded audio in, so later runs over the same files skip ffmpeg. "
+                   "Default is no cache.")
+@click.option("--cache-size", type=int, default=2048, help="The maximum size of the cache directory in MB. "
+                                                           "Least recently used entries are removed first. "
+                                                           "Default is 2048 MB.")
+@click.option("--index", "index", type=click.Path(dir_okay=False), default=None,
+              help="Fingerprint index (SQLite file) to look files up in. Files missing from it are searched as usual "
+                   "and added, indexed files are only verified around the fingerprint match. Default is no index.")
+@click.option("--incremental", is_flag=True,
+              help="Only search files that are new or changed since the last run and merge in the stored results "
+                   "of all other files.")
+@click.option("--results-db", type=click.Path(dir_okay=False), default=_RESULTS_DB,
+              help=f"The SQLite file results are stored in for --incremental. Default is '{_RESULTS_DB}'.")
+@click.option("--shard", type=str, default=None,
+              help="Only search shard K of N, e.g. '2/4', with files split by a hash of their path. "
+                   "Default is to search all files.")
+@click.option("--queue", "queue_dir", type=click.Path(file_okay=False), default=None,
+              help="Work queue directory shared by several aivd processes searching the same directory, every file "
+                   "is searched by whichever process claims it first. Default is no queue.")
+@click.option("--server", is_flag=True,
+              help="Send the search to a running 'aivd serve' daemon instead of starting workers in this process.")
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), default=_SOCKET,
+              help=f"The Unix socket of the daemon for --server. Default is '{_SOCKET}'.")
+@click.option("--no-clean", is_flag=True, hidden=True,
+              help="Deprecated, does nothing. Files are decoded in memory, there are no temporary files to keep.")
 @click.option("--silent", is_flag=True, help="Do not print anything but the final output to the console.")
 @click.option("--debug", is_flag=True, help="Print debug information to the console.")
 @click.option("--dry-run", is_flag=True, help="Do not run the program, just print the parameters.")
@@ -61,13 +204,15 @@ def load_legacy(ctx, _param, value):
               expose_value=False, is_eager=True)
 @click.option("--legacy", is_flag=True, help="Use the legacy cli.", callback=load_legacy,
               expose_value=False, is_eager=True)
-def main(input_file, directory, recursive, extension, exclude, time_, window, format_, threads, ffmpeg,
-         ffmpeg_processes, ffmpeg_args, no_clean, silent, debug, dry_run):
+def main(input_files, directory, recursive, extension, exclude, time_, window, max_window, start, end, from_end,
+         min_confidence, analysis_rate, top, format_, with_metrics, metrics_file, metrics_format, threads, batch_size,
+         ffmpeg, ffmpeg_processes, ffmpeg_timeout, ffmpeg_args, cache_dir, cache_size, index, incremental, results_db,
+         shard, queue_dir, server, socket_path, no_clean, silent, debug, dry_run):
     """
     Find the INPUT_FILE audio file in the specified video or audio files in a folder and return the time index.
 
     \b
-    INPUT_FILE: The audio file to search for.
+    INPUT_FILE: The audio file to search for. Can be given multiple times to search for several files at once.
     DIRECTORY: The directory with the video or audio files to search in.
     """
 
@@ -79,53 +224,250 @@ def main(input_file, directory, recursive, extension, exclude, time_, window, fo
     if window < 1:
         logger.error("Window must be greater than 0.")
         exit(-1)
+    if max_window is not None and max_window < window:
+        logger.error("Max window must not be smaller than the window.")
+        exit(-1)
+    if start < 0:
+        logger.error("Start must be 0 or greater.")
+        exit(-1)
+    if end is not None and end <= start:
+        logger.error("End must be greater than the start.")
+        exit(-1)
+    if end is not None and max_window is not None:
+        logger.error("End can't be combined with a max window, the range is searched in one window.")
+        exit(-1)
+    if from_end is not None and from_end <= 0:
+        logger.error("From end must be greater than 0.")
+        exit(-1)
+    if from_end is not None and (start > 0 or end is not None):
+        logger.error("From end can't be combined with a start or end.")
+        exit(-1)
+    if from_end is not None and max_window is not None and max_window > window:
+        # The tail is searched in one window that is never widened, a wider max window would be silently ignored
+        logger.error("From end searches a single window, it can't be combined with a wider max window.")
+        exit(-1)
+    if index is not None and (start > 0 or from_end is not None):
+        logger.error("The fingerprint index only covers searches from the beginning of the files.")
+        exit(-1)
+    if index is not None and max_window is not None and max_window > window:
+        # Indexed files without a fingerprint match are never decoded, so a match beyond the window would be lost
+        logger.error("The fingerprint index only covers the first window, it can't be combined with a wider max "
+                     "window.")
+        exit(-1)
+    if top < 0:
+        logger.error("Top must be 0 or greater.")
+        exit(-1)
+    if analysis_rate < 0:
+        logger.error("Analysis rate must be 0 or greater.")
+        exit(-1)
     if threads < 1 or threads > os_helpers.thread_count():
         logger.error(f"Threads must be between 1 and {os_helpers.thread_count()} (CPU thread count).")
         exit(-1)
+    if ffmpeg_processes < 1:
+        logger.error("FFmpeg processes must be greater than 0.")
+        exit(-1)
+    if ffmpeg_timeout is not None and ffmpeg_timeout <= 0:
+        logger.error("FFmpeg timeout must be greater than 0.")
+        exit(-1)
+    if cache_size < 1:
+        logger.error("Cache size must be greater than 0.")
+        exit(-1)
+    if batch_size < 1:
+        logger.error("Batch size must be 1 or greater.")
+        exit(-1)
+    if server and (index is not None or cache_dir is not None or with_metrics or metrics_file is not None
+                   or batch_size > 1):
+        logger.error("The fingerprint index, the decode cache, metrics and batches are not available with --server.")
+        exit(-1)
+    shards = None
+    if shard is not None:
+        try:
+            shard, shards = (int(part) for part in shard.split("/"))
+        except ValueError:
+            logger.error("Shard must be given as K/N, e.g. '2/4'.")
+            exit(-1)
+        if not 1 <= shard <= shards:
+            logger.error("Shard K/N needs K between 1 and N.")
+            exit(-1)
+    ffmpeg_args = shlex.split(ffmpeg_args) \
+        if (ffmpeg_args is not None and ffmpeg_args != "" and ffmpeg_args != "None") else None
+    # The range up to the end is searched as a single window
+    if end is not None:
+        window = end - start
 
     logger.info("Starting AIVD...")
+    if no_clean:
+        logger.debug("--no-clean is deprecated and has no effect, no temporary files are written.")
     logger.debug(f"AIVD Version: {__version__}")
     logger.debug("Starting with the following parameters:")
-    logger.debug(f"\tInput file: '{input_file}'")
+    logger.debug(f"\tInput files: {', '.join(repr(input_file) for input_file in input_files)}")
     logger.debug(f"\tDirectory: '{directory}'")
     logger.debug(f"\tRecursive: {recursive}")
     logger.debug(f"\tExtension: {extension}")
     logger.debug(f"\tExclude: {exclude}")
     logger.debug(f"\tTime: {time_}")
     logger.debug(f"\tWindow: {window}")
+    logger.debug(f"\tMax window: {max_window}")
+    logger.debug(f"\tStart: {start}")
+    logger.debug(f"\tEnd: {end}")
+    logger.debug(f"\tFrom end: {from_end}")
+    logger.debug(f"\tMin confidence: {min_confidence}")
+    logger.debug(f"\tAnalysis rate: {analysis_rate}")
+    logger.debug(f"\tTop: {top}")
     logger.debug(f"\tFormat: {format_}")
+    logger.debug(f"\tMetrics: {with_metrics}")
+    logger.debug(f"\tMetrics file: {metrics_file if metrics_file is None else repr(metrics_file)}")
+    logger.debug(f"\tMetrics format: {metrics_format}")
     logger.debug(f"\tThreads: {threads}")
+    logger.debug(f"\tBatch size: {batch_size}")
     logger.debug(f"\tFFmpeg: '{ffmpeg}'")
     logger.debug(f"\tFFmpeg processes: {ffmpeg_processes}")
+    logger.debug(f"\tFFmpeg timeout: {ffmpeg_timeout}")
     logger.debug(f"\tFFmpeg args: {ffmpeg_args}")
-    logger.debug(f"\tSkipping clean up: {no_clean}")
+    logger.debug(f"\tCache directory: {cache_dir if cache_dir is None else repr(cache_dir)}")
+    logger.debug(f"\tCache size: {cache_size} MB")
+    logger.debug(f"\tFingerprint index: {index if index is None else repr(index)}")
+    logger.debug(f"\tIncremental: {incremental}")
+    logger.debug(f"\tResults database: '{results_db}'")
+    logger.debug(f"\tShard: {shard if shards is None else f'{shard}/{shards}'}")
+    logger.debug(f"\tQueue: {queue_dir if queue_dir is None else repr(queue_dir)}")
+    logger.debug(f"\tServer: {server}")
+    logger.debug(f"\tSocket: '{socket_path}'")
     logger.empty_line()
 
     logger.info("Checking if ffmpeg exists...")
-    if not os.path.exists(ffmpeg):
+    if not server and not os.path.exists(ffmpeg):
         logger.error(f"ffmpeg not found at '{ffmpeg}'.")
         exit(-1)
     logger.debug("ffmpeg found.")
     logger.empty_line()
 
+    # Files are found lazily and handed to the detector while the directory is still being walked
     files = os_helpers.file_walker(directory, logger, recursive, extension, exclude)
-    logger.empty_line()
-
-    ready, to_convert = os_helpers.is_audio_files(files)
-    logger.info(f"Found {len(files)} files to search in{':' if debug else '.'}")
-    logger.debug(f"\t{len(ready)} audio files.")
-    logger.debug(f"\t{len(to_convert)} files to be converted.")
-    logger.empty_line()
+    if shards is not None:
+        files = (file for file in files if os_helpers.in_shard(file, directory, shard, shards))
 
     if dry_run:
+        files = list(files)
+        logger.empty_line()
+
+        ready, to_convert = os_helpers.is_audio_files(files)
+        logger.info(f"Found {len(files)} files to search in{':' if debug else '.'}")
+        logger.debug(f"\t{len(ready)} audio files.")
+        logger.debug(f"\t{len(to_convert)} files to be converted.")
+        logger.empty_line()
+
         logger.info("Dry run, exiting!")
         return
 
-    with Detector(input_file, files, time_, window, ffmpeg, logger, not no_clean, threads, ffmpeg_processes)\
-            as detector:
-        data = detector.run(
-            ffmpeg_args if (ffmpeg_args is not None and ffmpeg_args != "" and ffmpeg_args != "None") else None
-        )
+    work_queue = None
+    if queue_dir is not None:
+        from utils.work_queue import WorkQueue
+        try:
+            work_queue = WorkQueue(queue_dir, directory)
+        except OSError as e:
+            logger.error(f"Could not create work queue directory '{queue_dir}': '{e}'")
+            exit(2)
+        # Files are claimed one by one as the search pulls them, so faster processes take on more of them
+        files = work_queue.claimed(files)
+
+    store = None
+    previous = {}
+    searched = []
+    # JSON Lines are written as results complete, nothing is kept for the output once it is written
+    emit = _line_writer(input_files) if format_ == "jsonl" else None
+    if incremental:
+        from utils.results import ResultStore, needle_key
+
+        logger.info("Loading previous results...")
+        try:
+            store = ResultStore(results_db)
+            # Results only carry over for the same input file content and search parameters. ffmpeg arguments can
+            # change the decoded audio, and the first input file sets the sample rate every other one is searched at
+            rate_key = needle_key(input_files[0]) if len(input_files) > 1 else None
+            needles = {input_file: needle_key(input_file, time_, window, max_window, min_confidence, analysis_rate,
+                                              top, start, from_end, ffmpeg_args, rate_key)
+                       for input_file in input_files}
+            files = _changed_files(files, store, needles, previous, searched, emit)
+        except Exception as e:
+            logger.error(f"Error reading results database '{results_db}': '{e}'")
+            exit(2)
+        logger.empty_line()
+
+    on_result = None
+    if emit is not None:
+        def on_result(file, matches):
+            if store is not None:
+                for input_file, match in matches.items():
+                    store.put(needles[input_file], file, match)
+            emit(file, matches)
+
+    data = {}
+    run_metrics = None
+    # Peek at the first file, nothing has to be loaded if there is nothing to search in
+    first = next(files, None)
+    if first is not None and server:
+        data = _submit(socket_path, input_files, [first, *files], logger, {
+            "time_": time_,
+            "window": window,
+            "max_window": max_window,
+            "min_confidence": min_confidence,
+            "analysis_rate": analysis_rate,
+            "top": top,
+            "ffmpeg_args": ffmpeg_args,
+            "ffmpeg_timeout": ffmpeg_timeout,
+            "start": start,
+            "from_end": from_end
+        }, on_result)
+    elif first is not None:
+        from detector import Detector
+
+        with Detector(list(input_files), itertools.chain([first], files), time_, window, ffmpeg, logger, threads,
+                      ffmpeg_processes, cache_dir=cache_dir, cache_size=cache_size * 1024 * 1024,
+                      analysis_rate=analysis_rate, max_window=max_window, min_confidence=min_confidence, top=top,
+                      fingerprint_index=index, ffmpeg_timeout=ffmpeg_timeout, start=start, from_end=from_end,
+                      batch_size=batch_size, collect_metrics=with_metrics or metrics_file is not None) as detector:
+            data = detector.run(ffmpeg_args, on_result)
+            run_metrics = detector.metrics
+    elif with_metrics or metrics_file is not None:
+        from utils.metrics import summarise
+        # Nothing to search, consumers still get a run summary with every counter and stage at zero
+        run_metrics = summarise({}, 0.0)
+
+    if work_queue is not None:
+        work_queue.finish()
+
+    if run_metrics is not None:
+        batch = run_metrics["batch"]
+        logger.debug(f"Searched {batch['files']} files in {batch['wall']:.2f} seconds: decode {batch['decode']:.2f}, "
+                     f"resample {batch['resample']:.2f}, correlate {batch['correlate']:.2f}, queue wait "
+                     f"{batch['queue_wait']:.2f} seconds summed over all files.")
+        logger.empty_line()
+
+        if metrics_file is not None:
+            from utils.metrics import write
+            try:
+                write(metrics_file, run_metrics, metrics_format)
+            except OSError as e:
+                logger.error(f"Could not write metrics file '{metrics_file}': '{e}'")
+
+    if store is not None and emit is None:
+        logger.debug(f"{len(previous)} files were unchanged, {len(searched) - len(previous)} files were new or "
+                     f"changed.")
+        logger.empty_line()
+        with store:
+            for file, matches in data.items():
+                for input_file, match in matches.items():
+                    store.put(needles[input_file], file, match)
+        data = {file: previous.get(file, data.get(file)) for file in searched if file in previous or file in data}
+    elif store is not None:
+        store.close()
+
+    # A single input file keeps the flat file -> match mapping
+    if len(input_files) == 1:
+        data = {file: matches[input_files[0]] for file, matches in data.items()}
+    if with_metrics and format_ in ("json", "raw"):
+        data["metrics"] = run_metrics
 
     if format_ == "json":
         logger.debug("Outputting JSON...")
@@ -133,18 +475,214 @@ def main(input_file, directory, recursive, extension, exclude, time_, window, fo
 
         click.echo(json.dumps(data))
 
+    elif format_ == "jsonl":
+        if with_metrics:
+            click.echo(json.dumps({"metrics": run_metrics}))
+
     elif format_ == "txt":
         logger.debug("Outputting in formatted text...")
         logger.empty_line()
 
-        for file, offset in data.items():
-            click.echo(f"{Fore.RESET}{file.split('/').pop()} {Fore.CYAN}({Fore.WHITE}{file}{Fore.CYAN})"
-                       f"\n\t{Fore.GREEN}-> {Fore.RESET}{offset}{Fore.WHITE}s {Fore.RESET}offset{Style.RESET_ALL}")
+        _echo_text(data)
         logger.empty_line()
 
     elif format_ == "raw":
         click.echo(json.dumps(data).encode("utf-8"))
 
 
+@click.command()
+@click.option("--socket", "socket_path", type=click.Path(dir_okay=False), default=_SOCKET,
+              help=f"The Unix socket to listen on. Default is '{_SOCKET}'.")
+@click.option("-c", "--threads", type=int, default=lambda: os_helpers.thread_count() / 2,
+              help="The number of worker processes to keep running. Default is half the number of CPU cores.")
+@click.option("--ffmpeg", type=click.Path(exists=True), default=lambda: os_helpers.find_ffmpeg(),
+              help="The path to the ffmpeg executable. Default is the system path.")
+@click.option("--ffmpeg-processes", type=int, default=1, help="The number of ffmpeg processes to run at the same time."
+                                                              "Default is 1.")
+@click.option("--needle-cache", type=int, default=8, help="How many prepared input files to keep loaded between "
+                                                          "jobs. Default is 8.")
+@click.option("--silent", is_flag=True, help="Do not print anything to the console.")
+@click.option("--debug", is_flag=True, help="Print debug information to the console.")
+def serve(socket_path, threads, ffmpeg, ffmpeg_processes, needle_cache, silent, debug):
+    """
+    Keep workers and loaded input files warm and run searches sent with 'aivd --server'.
+    """
+    import asyncio
+    from engine import Engine
+    from server import serve as run_server, ServerError
+
+    logger = Logger(silent, debug)
+
+    if threads < 1 or threads > os_helpers.thread_count():
+        logger.error(f"Threads must be between 1 and {os_helpers.thread_count()} (CPU thread count).")
+        exit(-1)
+    if ffmpeg_processes < 1:
+        logger.error("FFmpeg processes must be greater than 0.")
+        exit(-1)
+    if needle_cache < 1:
+        logger.error("Needle cache must be greater than 0.")
+        exit(-1)
+
+    engine = Engine(threads, ffmpeg, ffmpeg_processes, logger, needle_cache)
+    try:
+        asyncio.run(run_server(socket_path, engine, logger))
+    except ServerError as e:
+        logger.error(str(e))
+        exit(2)
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+    finally:
+        engine.close()
+
+
+@click.command()
+@click.argument("directory", type=click.Path(exists=True, file_okay=False), metavar="DIRECTORY")
+@click.option("-r", "--recursive", is_flag=True, help="Search recursively in the specified directory.")
+@click.option("-e", "--extension", type=str, default=','.join(_PERMITTED_EXTENSIONS),
+              help="The extension of the video/audio files to search in. "
+                   f"Default is '{','.join(_PERMITTED_EXTENSIONS)}'. Can be a comma separated list.")
+@click.option("-x", "--exclude", type=str, default="", help="Exclude the specified extension from the search. "
+                                                            "Default is no exclusions. Can be a comma separated list.")
+@click.option("-w", "--window", type=int, default=300, help="How many seconds of every file to compare. "
+                                                            "Default is 300 seconds.")
+@click.option("--start", type=float, default=0,
+              help="Compare from this many seconds into every file on. Default is 0, the beginning of the file.")
+@click.option("--from-end", type=float, default=None,
+              help="Compare the last this many seconds of every file instead, e.g. to find an outro. "
+                   "Default is to compare from the start.")
+@click.option("--min-share", type=float, default=0.5,
+              help="The share of files a segment has to be found in, between 0 and 1. Default is 0.5.")
+@click.option("--min-length", type=float, default=5.0,
+              help="The shortest segment in seconds to report. Default is 5 seconds.")
+@click.option("-f", "--format", "format_", type=click.Choice(["json", "txt"]), default="txt",
+              help="The output format. Default is txt.")
+@click.option("-c", "--threads", type=int, default=lambda: os_helpers.thread_count() / 2,
+              help="The number of files to fingerprint at the same time. Default is half the number of CPU cores.")
+@click.option("--ffmpeg", type=click.Path(exists=True), default=lambda: os_helpers.find_ffmpeg(),
+              help="The path to the ffmpeg executable. Default is the system path.")
+@click.option("--silent", is_flag=True, help="Do not print anything but the final output to the console.")
+@click.option("--debug", is_flag=True, help="Print debug information to the console.")
+def discover(directory, recursive, extension, exclude, window, start, from_end, min_share, min_length, format_,
+             threads, ffmpeg, silent, debug):
+    """
+    Find the longest audio segment most files in DIRECTORY share, e.g. an intro, and its offset in every file.
+
+    \b
+    DIRECTORY: The directory with the video or audio files to compare.
+    """
+    from discover import discover as find_segment
+
+    logger = Logger(silent, debug)
+
+    if window < 1:
+        logger.error("Window must be greater than 0.")
+        exit(-1)
+    if start < 0:
+        logger.error("Start must be 0 or greater.")
+        exit(-1)
+    if from_end is not None and from_end <= 0:
+        logger.error("From end must be greater than 0.")
+        exit(-1)
+    if from_end is not None and start > 0:
+        logger.error("From end can't be combined with a start.")
+        exit(-1)
+    if not 0 < min_share <= 1:
+        logger.error("Min share must be greater than 0 and at most 1.")
+        exit(-1)
+    if min_length <= 0:
+        logger.error("Min length must be greater than 0.")
+        exit(-1)
+    if threads < 1 or threads > os_helpers.thread_count():
+        logger.error(f"Threads must be between 1 and {os_helpers.thread_count()} (CPU thread count).")
+        exit(-1)
+    if not os.path.exists(ffmpeg):
+        logger.error(f"ffmpeg not found at '{ffmpeg}'.")
+        exit(-1)
+
+    files = list(os_helpers.file_walker(directory, logger, recursive, extension, exclude))
+    logger.empty_line()
+    if len(files) < 2:
+        logger.error("At least two files are needed to find a shared segment.")
+        exit(1)
+
+    logger.info(f"Fingerprinting {len(files)} files...")
+    result = find_segment(files, window, start, from_end, ffmpeg, int(threads), min_share, min_length, logger)
+    logger.empty_line()
+    if result is None:
+        logger.error(f"No segment of at least {min_length} seconds is shared by {min_share:.0%} of the files.")
+        exit(1)
+
+    if format_ == "json":
+        click.echo(json.dumps(result))
+        return
+
+    segment = result["segment"]
+    click.echo(f"{Fore.RESET}Segment of {Fore.WHITE}{segment['duration']}s {Fore.RESET}found in {segment['files']} "
+               f"of {len(result['files'])} files{Style.RESET_ALL}")
+    for file, match in result["files"].items():
+        click.echo(f"{Fore.RESET}{file.split('/').pop()} {Fore.CYAN}({Fore.WHITE}{file}{Fore.CYAN})")
+        offset = "not found" if match["offset"] < 0 else f"{match['offset']}{Fore.WHITE}s {Fore.RESET}offset"
+        click.echo(f"\t{Fore.GREEN}-> {Fore.RESET}{offset}{Style.RESET_ALL}")
+
+
+@click.command()
+@click.argument("result_files", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False),
+                metavar="RESULT_FILE...")
+@click.option("-f", "--format", "format_", type=click.Choice(["json", "jsonl", "txt"]), default="json",
+              help="The output format. Default is JSON.")
+@click.option("--silent", is_flag=True, help="Do not print anything but the final output to the console.")
+@click.option("--debug", is_flag=True, help="Print debug information to the console.")
+def merge(result_files, format_, silent, debug):
+    """
+    Combine the json, raw or jsonl output of several runs, e.g. of every --shard, into one output.
+
+    \b
+    RESULT_FILE: An output file of a run. A file found in several of them keeps the result of the last one given.
+    """
+    from utils.results import read_output
+
+    logger = Logger(silent, debug)
+
+    data = {}
+    single = None
+    for result_file in result_files:
+        try:
+            results = read_output(result_file)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not read results from '{result_file}': '{e}'")
+            exit(2)
+        logger.debug(f"Read {len(results)} results from '{result_file}'.")
+
+        for file, result in results.items():
+            # A single input file's results are matches, several input files' results map input files to matches
+            if single is None:
+                single = "offset" in result
+            elif single != ("offset" in result):
+                logger.error(f"'{result_file}' holds results of a different number of input files.")
+                exit(2)
+            if file in data:
+                logger.debug(f"\t'{file}' is in several result files, keeping the result from '{result_file}'.")
+            data[file] = result
+
+    logger.info(f"Merged the results of {len(data)} files from {len(result_files)} result files.")
+    logger.empty_line()
+
+    if format_ == "json":
+        click.echo(json.dumps(data))
+    elif format_ == "jsonl":
+        for file, result in data.items():
+            click.echo(json.dumps({"file": file, "match" if single else "matches": result}))
+    elif format_ == "txt":
+        _echo_text(data)
+
+
+# Subcommands are picked by the first argument, anything else is a search
+_COMMANDS = {"serve": serve, "discover": discover, "merge": merge}
+
+
 if __name__ == '__main__':
-    main()
+    if len(sys.argv) > 1 and sys.argv[1] in _COMMANDS:
+        command = sys.argv.pop(1)
+        _COMMANDS[command](prog_name=f"aivd {command}")
+    else:
+        main()
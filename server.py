@@ -0,0 +1,113 @@
+import os
+import json
+import socket
+import traceback
+
+from utils.logger import Logger
+
+
+class ServerError(Exception):
+    """A job the server rejected or could not run."""
+
+
+async def _handle(engine, logger: Logger, reader, writer):
+    from engine import DetectionError
+
+    try:
+        line = await reader.readline()
+        if not line:
+            # A probe checking whether the server is alive
+            writer.close()
+            return
+        job = json.loads(line)
+        logger.info(f"Searching {len(job['paths'])} files for {', '.join(repr(n) for n in job['needles'])}...")
+
+        async for result in engine.detect_stream(job["needles"], job["paths"], **job.get("options", {})):
+            writer.write(json.dumps(result).encode("utf-8") + b"\n")
+            await writer.drain()
+        writer.write(json.dumps({"done": True}).encode("utf-8") + b"\n")
+        logger.debug(f"\tJob for {', '.join(repr(n) for n in job['needles'])} complete.")
+    except ConnectionError:
+        logger.debug("\tClient disconnected, job cancelled.")
+        return
+    except (DetectionError, ValueError, TypeError, KeyError) as e:
+        logger.error(f"\tJob failed: '{e}'")
+        writer.write(json.dumps({"done": True, "error": str(e)}).encode("utf-8") + b"\n")
+    except Exception as e:
+        logger.error(f"\tJob failed: '{e}'", traceback.format_exc())
+        writer.write(json.dumps({"done": True, "error": f"Internal error: {e}"}).encode("utf-8") + b"\n")
+
+    try:
+        await writer.drain()
+        writer.close()
+    except ConnectionError:
+        pass
+
+
+def _alive(socket_path):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            return False
+    return True
+
+
+async def serve(socket_path, engine, logger: Logger):
+    """
+    Run jobs for ``submit`` clients on ``engine`` until cancelled.
+
+    The engine's worker pool is started and warmed up front and keeps its needle cache between jobs, so a job only
+    pays for decoding and correlating its files. Every connection carries one job as a JSON line and receives one
+    JSON line per searched file as soon as it is complete, followed by a ``done`` line.
+    """
+    import asyncio
+
+    if os.path.exists(socket_path):
+        if _alive(socket_path):
+            raise ServerError(f"A server is already listening on '{socket_path}'.")
+        # Left over from a server that did not shut down cleanly
+        os.remove(socket_path)
+    if os.path.dirname(socket_path):
+        os.makedirs(os.path.dirname(socket_path), exist_ok=True)
+
+    logger.info("Starting workers...")
+    await engine.warm()
+
+    server = await asyncio.start_unix_server(lambda reader, writer: _handle(engine, logger, reader, writer),
+                                             path=socket_path)
+    try:
+        os.chmod(socket_path, 0o600)
+        logger.info(f"Listening on '{socket_path}'.")
+        async with server:
+            await server.serve_forever()
+    finally:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def submit(socket_path, needles, paths, options):
+    """
+    Send a job to a running server and yield its per-file results as they arrive.
+
+    Raises ``ServerError`` if no server is listening on ``socket_path`` or the job fails as a whole.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        try:
+            client.connect(socket_path)
+        except OSError as e:
+            raise ServerError(f"No server listening on '{socket_path}': {e}") from e
+
+        job = {"needles": needles, "paths": paths, "options": options}
+        client.sendall(json.dumps(job).encode("utf-8") + b"\n")
+
+        with client.makefile("r", encoding="utf-8") as stream:
+            for line in stream:
+                message = json.loads(line)
+                if message.get("done"):
+                    if message.get("error") is not None:
+                        raise ServerError(message["error"])
+                    return
+                yield message
+
+    raise ServerError("The server closed the connection before the job was complete.")
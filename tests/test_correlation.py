@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+from scipy.signal import correlate
+
+from utils.correlation import CoarseToFineFilter, MatchedFilter, peak_statistics, top_peaks
+
+_SR = 16000
+
+
+def _noise(seconds, seed):
+    return np.random.default_rng(seed).standard_normal(int(seconds * _SR)).astype(np.float32)
+
+
+def test_peak_statistics_of_a_spike():
+    c = np.random.default_rng(1).normal(0.0, 0.1, 10000).astype(np.float32)
+    c[2500] = 5.0
+
+    statistics = peak_statistics(c, 2500)
+    sidelobes = np.delete(c, range(2490, 2511)).astype(np.float64)
+    assert statistics["psr"] == pytest.approx((5.0 - sidelobes.mean()) / sidelobes.std(), rel=1e-4)
+    assert statistics["ratio"] == pytest.approx(5.0 / sidelobes.max(), rel=1e-6)
+    assert "top" not in statistics
+
+
+def test_peak_statistics_without_sidelobes():
+    # Nothing varies outside the main lobe and nothing there is above zero
+    c = np.zeros(1000, dtype=np.float32)
+    c[100] = 1.0
+    assert peak_statistics(c, 100) == {"psr": 0.0, "ratio": None}
+
+
+def test_peak_statistics_top():
+    c = np.zeros(10000, dtype=np.float32)
+    c[[1000, 1005, 6000, 8000]] = [4.0, 3.5, 3.0, 2.0]
+
+    # 1005 lies within the main lobe of 1000, it doesn't count as a peak of its own
+    assert peak_statistics(c, 1000, top=3)["top"] == [1000, 6000, 8000]
+
+
+def test_top_peaks_keeps_the_exclusion():
+    c = np.zeros(500, dtype=np.float32)
+    c[[100, 103, 110, 400]] = [1.0, 0.9, 0.8, 0.7]
+
+    assert top_peaks(c, 3, 5) == [100, 110, 400]
+    assert top_peaks(c, 2, 50) == [100, 400]
+
+
+def test_matched_filter_equals_correlate():
+    haystack = _noise(3, 2)
+    needles = [_noise(0.5, 3), _noise(0.25, 4)]
+
+    # A small block size, so the haystack spans several overlap-save blocks
+    for needle, output in zip(needles, MatchedFilter(needles, block_size=1 << 14).correlate(haystack)):
+        expected = correlate(haystack.astype(np.float64), needle.astype(np.float64), mode="valid")
+        np.testing.assert_allclose(output, expected, rtol=1e-3, atol=1e-2)
+
+
+@pytest.mark.parametrize("offset", [0, 12345, 2 * _SR + 7])
+def test_matched_filter_finds_a_copy(offset):
+    haystack = _noise(4, 5)
+    needle = haystack[offset:offset + _SR].copy()
+
+    match, = MatchedFilter([needle]).find(haystack, top=2)
+    assert match["peak"] == offset
+    assert match["score"] == pytest.approx(1.0, abs=1e-5)
+    assert match["psr"] > 50
+    assert match["ratio"] > 2
+    assert match["top"][0] == offset
+
+
+def test_matched_filter_needle_longer_than_haystack():
+    assert MatchedFilter([_noise(2, 6)]).find(_noise(1, 7)) == [None]
+
+
+@pytest.mark.parametrize("offset", [0, 12345, 2 * _SR + 7])
+def test_coarse_to_fine_is_sample_accurate(offset):
+    haystack = _noise(4, 8)
+    needles = [haystack[offset:offset + _SR].copy(), _noise(1, 9)]
+
+    found, missing = CoarseToFineFilter(needles, _SR, 8000).find(haystack)
+    assert found["peak"] == offset
+    assert found["score"] == pytest.approx(1.0, abs=1e-5)
+    assert found["psr"] > missing["psr"]
+    assert missing["score"] < 0.2
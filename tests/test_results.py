@@ -0,0 +1,70 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from main import merge
+from utils.results import read_output
+
+_MATCH = {"offset": 12.5, "score": 0.7, "psr": 146.7, "ratio": 29.5}
+_OTHER = {"offset": 33.0, "score": 0.7, "psr": 146.0, "ratio": 28.4}
+
+
+def _write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_read_json(tmp_path):
+    path = _write(tmp_path / "out.json", json.dumps({"/media/ep1.mkv": _MATCH, "metrics": {"files": {}, "batch": {}}}))
+    assert read_output(path) == {"/media/ep1.mkv": _MATCH}
+
+
+def test_read_jsonl(tmp_path):
+    lines = [{"file": "/media/ep1.mkv", "match": _MATCH}, {"file": "/media/ep2.mkv", "match": _OTHER},
+             {"metrics": {"files": {}, "batch": {}}}]
+    path = _write(tmp_path / "out.jsonl", "\n".join(json.dumps(line) for line in lines) + "\n")
+    assert read_output(path) == {"/media/ep1.mkv": _MATCH, "/media/ep2.mkv": _OTHER}
+
+
+def test_read_single_jsonl_line(tmp_path):
+    # One line is valid JSON on its own as well, it must still be read as a line and not as a json output
+    path = _write(tmp_path / "out.jsonl", json.dumps({"file": "/media/ep1.mkv", "matches": {"intro.wav": _MATCH}}))
+    assert read_output(path) == {"/media/ep1.mkv": {"intro.wav": _MATCH}}
+
+
+@pytest.mark.parametrize("text", ["", "\n", "  \n\n"])
+def test_read_empty(tmp_path, text):
+    assert read_output(_write(tmp_path / "out.jsonl", text)) == {}
+
+
+@pytest.mark.parametrize("text", ["[1, 2]", "{\"/media/ep1.mkv\": 12.5}", "not json"])
+def test_read_invalid(tmp_path, text):
+    with pytest.raises(ValueError):
+        read_output(_write(tmp_path / "out.json", text))
+
+
+def test_merge_empty_shard(tmp_path):
+    empty = _write(tmp_path / "shard1.jsonl", "")
+    full = _write(tmp_path / "shard2.json", json.dumps({"/media/ep1.mkv": _MATCH}))
+
+    result = CliRunner().invoke(merge, [empty, full, "--silent"])
+    assert result.exit_code == 0, result.output
+    assert json.loads(result.output) == {"/media/ep1.mkv": _MATCH}
+
+
+def test_merge_last_result_wins(tmp_path):
+    first = _write(tmp_path / "shard1.json", json.dumps({"/media/ep1.mkv": _OTHER, "/media/ep2.mkv": _OTHER}))
+    second = _write(tmp_path / "shard2.jsonl", json.dumps({"file": "/media/ep1.mkv", "match": _MATCH}) + "\n")
+
+    result = CliRunner().invoke(merge, [first, second, "--silent", "-f", "jsonl"])
+    assert result.exit_code == 0, result.output
+    lines = [json.loads(line) for line in result.output.splitlines()]
+    assert lines == [{"file": "/media/ep1.mkv", "match": _MATCH}, {"file": "/media/ep2.mkv", "match": _OTHER}]
+
+
+def test_merge_refuses_mixed_input_counts(tmp_path):
+    single = _write(tmp_path / "shard1.json", json.dumps({"/media/ep1.mkv": _MATCH}))
+    several = _write(tmp_path / "shard2.json", json.dumps({"/media/ep2.mkv": {"intro.wav": _MATCH}}))
+
+    assert CliRunner().invoke(merge, [single, several, "--silent"]).exit_code == 2
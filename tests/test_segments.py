@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from utils.fingerprint import FINGERPRINT_RATE, frames_to_seconds, landmarks
+from utils.segments import Reference, _intervals, discover
+
+# Where the shared 15 second segment starts in each file, None for a file without it
+_OFFSETS = [3.0, 17.5, 0.0, 30.0, None, 8.0]
+_LENGTH = 15.0
+_DURATION = 60.0
+# One landmark frame, the resolution offsets are found at
+_FRAME = frames_to_seconds(1)
+
+
+def _signal(seconds, seed):
+    return np.random.default_rng(seed).standard_normal(int(seconds * FINGERPRINT_RATE)).astype(np.float32)
+
+
+def _file(offset, seed, shared):
+    samples = _signal(_DURATION, seed)
+    if offset is not None:
+        start = int(offset * FINGERPRINT_RATE)
+        samples[start:start + len(shared)] = shared
+    return samples
+
+
+@pytest.fixture(scope="module")
+def fingerprints():
+    shared = _signal(_LENGTH, 100)
+    return [landmarks(_file(offset, seed, shared), FINGERPRINT_RATE) for seed, offset in enumerate(_OFFSETS)]
+
+
+def test_align_finds_the_delta(fingerprints):
+    reference = Reference(*fingerprints[0])
+
+    delta, votes, frames = reference.align(*fingerprints[1])
+    assert frames_to_seconds(delta) == pytest.approx(_OFFSETS[1] - _OFFSETS[0], abs=_FRAME)
+    assert votes >= 5
+    # Aligned landmarks only come from the shared segment of the reference
+    assert frames_to_seconds(frames[0]) >= _OFFSETS[0] - _FRAME
+    assert frames_to_seconds(frames[-1]) <= _OFFSETS[0] + _LENGTH + _FRAME
+
+
+def test_align_without_a_shared_segment(fingerprints):
+    assert Reference(*fingerprints[0]).align(*fingerprints[4]) is None
+
+
+def test_align_within(fingerprints):
+    reference = Reference(*fingerprints[0])
+    # Five seconds into the shared segment of the reference
+    within = (int((_OFFSETS[0] + 5) / _FRAME), int((_OFFSETS[0] + 10) / _FRAME))
+
+    delta, votes, frames = reference.align(*fingerprints[1], within=within)
+    assert frames_to_seconds(delta) == pytest.approx(_OFFSETS[1] - _OFFSETS[0], abs=_FRAME)
+    assert votes < reference.align(*fingerprints[1])[1]
+    assert within[0] <= frames[0] and frames[-1] <= within[1]
+
+
+def test_intervals():
+    frames = np.array([10, 11, 12, 40, 200, 201, 202, 203, 300, 301])
+
+    # Split at gaps of more than 63 frames, runs shorter than 3 frames are dropped
+    assert _intervals(frames) == [(10, 40), (200, 203)]
+    assert _intervals(np.zeros(0, dtype=np.int64)) == []
+
+
+def test_discover(fingerprints):
+    result = discover(fingerprints)
+
+    assert result["duration"] == pytest.approx(_LENGTH, abs=1.0)
+    assert result["start"] == pytest.approx(_OFFSETS[result["reference"]], abs=2 * _FRAME)
+    for offset, found in zip(_OFFSETS, result["offsets"]):
+        if offset is None:
+            assert found is None
+        else:
+            assert found[0] == pytest.approx(offset, abs=2 * _FRAME)
+
+
+def test_discover_needs_a_long_enough_segment(fingerprints):
+    assert discover(fingerprints, min_length=_LENGTH + 5) is None
+
+
+def test_discover_needs_enough_files(fingerprints):
+    # Only five of the six files share the segment
+    assert discover(fingerprints, min_share=1.0) is None
+    assert discover(fingerprints[:1]) is None
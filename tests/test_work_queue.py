@@ -0,0 +1,85 @@
+import os
+import socket
+import subprocess
+import sys
+
+from utils.work_queue import WorkQueue
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _queues(tmp_path):
+    return WorkQueue(str(tmp_path / "queue"), "/media"), WorkQueue(str(tmp_path / "queue"), "/media")
+
+
+def _write_claim(queue, file, owner):
+    with open(queue._lock_file(file), "w") as f:
+        f.write(owner + "\n")
+
+
+def test_claim_once(tmp_path):
+    first, second = _queues(tmp_path)
+
+    assert first.claim("/media/ep1.mkv")
+    assert not second.claim("/media/ep1.mkv")
+    assert second.claim("/media/ep2.mkv")
+    assert not first.claim("/media/ep2.mkv")
+
+
+def test_lock_files_are_relative_to_the_directory(tmp_path):
+    # Another machine mounting the library elsewhere must agree on the lock file
+    queue = WorkQueue(str(tmp_path / "queue"), "/media")
+    elsewhere = WorkQueue(str(tmp_path / "queue"), "/mnt/library")
+
+    assert queue._lock_file("/media/show/ep1.mkv") == elsewhere._lock_file("/mnt/library/show/ep1.mkv")
+    assert queue._lock_file("/media/show/ep1.mkv") != queue._lock_file("/media/show/ep2.mkv")
+
+
+def test_claimed_is_lazy(tmp_path):
+    first, second = _queues(tmp_path)
+    files = ["/media/ep1.mkv", "/media/ep2.mkv", "/media/ep3.mkv"]
+
+    claimed = first.claimed(files)
+    assert next(claimed) == "/media/ep1.mkv"
+    # The rest is only claimed as the generator is consumed, the other process gets the chance to take it
+    assert list(second.claimed(files)) == ["/media/ep2.mkv", "/media/ep3.mkv"]
+    assert list(claimed) == []
+
+
+def test_takes_over_a_dead_process(tmp_path):
+    queue, _ = _queues(tmp_path)
+    _write_claim(queue, "/media/ep1.mkv", f"{socket.gethostname()} {_dead_pid()}")
+
+    assert queue.claim("/media/ep1.mkv")
+    with open(queue._lock_file("/media/ep1.mkv")) as f:
+        assert f.read() == f"{socket.gethostname()} {os.getpid()}\n"
+    # Nothing of the takeover is left behind
+    assert os.listdir(queue.path) == [os.path.basename(queue._lock_file("/media/ep1.mkv"))]
+
+
+def test_keeps_live_and_foreign_claims(tmp_path):
+    queue, _ = _queues(tmp_path)
+    _write_claim(queue, "/media/ep1.mkv", f"{socket.gethostname()} {os.getppid()}")
+    # Whether a process on another host still runs can't be told, its claim stays
+    _write_claim(queue, "/media/ep2.mkv", f"{socket.gethostname()}.other {_dead_pid()}")
+    # A claim that is still being written
+    _write_claim(queue, "/media/ep3.mkv", "")
+
+    assert list(queue.claimed(["/media/ep1.mkv", "/media/ep2.mkv", "/media/ep3.mkv"])) == []
+
+
+def test_finish_marks_done(tmp_path):
+    first, second = _queues(tmp_path)
+    assert list(first.claimed(["/media/ep1.mkv", "/media/ep2.mkv"])) == ["/media/ep1.mkv", "/media/ep2.mkv"]
+
+    first.finish()
+    for file in ("/media/ep1.mkv", "/media/ep2.mkv"):
+        with open(first._lock_file(file)) as f:
+            assert f.read() == "done\n"
+        # Done files are never taken over, not even by a process on the same host
+        assert not second.claim(file)
+    assert len(os.listdir(first.path)) == 2
@@ -0,0 +1,83 @@
+import os
+import tempfile
+import subprocess
+from math import gcd
+
+import numpy as np
+
+from utils.wav import read_window
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+
+def _resample(samples, sr, target_rate):
+    from scipy.signal import resample_poly
+
+    divisor = gcd(int(target_rate), int(sr))
+    return resample_poly(samples, int(target_rate) // divisor, int(sr) // divisor).astype(np.float32)
+
+
+def _read_soundfile(file, sr, duration):
+    with soundfile.SoundFile(file) as f:
+        frames = -1 if duration is None else int(duration * f.samplerate)
+        samples = f.read(frames, dtype="float32", always_2d=True).mean(axis=1, dtype=np.float32)
+        native_rate = f.samplerate
+
+    if sr is not None and sr != native_rate:
+        return _resample(samples, native_rate, sr), sr
+    return samples, native_rate
+
+
+def _read_ffmpeg(file, sr, duration, ffmpeg):
+    # Decoded into a float WAV so the sample rate comes along with the samples
+    fd, temp = tempfile.mkstemp(suffix=".wav")
+    os.close(fd)
+    try:
+        command = [ffmpeg, "-nostdin", "-loglevel", "error", "-y", "-i", file]
+        if duration is not None:
+            command.extend(["-t", str(duration)])
+        if sr is not None:
+            command.extend(["-ar", str(sr)])
+        command.extend(["-vn", "-ac", "1", "-c:a", "pcm_f32le", "-f", "wav", temp])
+
+        process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise OSError(f"ffmpeg could not decode '{file}': {process.stderr.decode('utf-8').strip()}")
+
+        window = read_window(temp)
+        if window is None:
+            raise OSError(f"ffmpeg produced no readable audio for '{file}'")
+        # The mapping is read before the file goes away
+        return np.array(window[0]), window[1]
+    finally:
+        os.remove(temp)
+
+
+def load(file, sr=None, duration=None, ffmpeg=None):
+    """
+    Load an audio file as mono float32 samples, without librosa.
+
+    Plain WAVs are mapped directly, other formats go through ``soundfile`` if it is installed and can read them,
+    and through ``ffmpeg`` otherwise. ``sr=None`` keeps the file's own sample rate, ``duration`` limits the load to
+    the first seconds. Returns ``(samples, sample_rate)``.
+    """
+    try:
+        window = read_window(file, duration, sr)
+    except Exception:
+        window = None
+    if window is not None:
+        return np.array(window[0]), window[1]
+
+    if soundfile is not None:
+        try:
+            return _read_soundfile(file, sr, duration)
+        except Exception as e:
+            if ffmpeg is None:
+                raise OSError(f"Could not read '{file}': {e}") from e
+
+    if ffmpeg is None:
+        raise OSError(f"Could not read '{file}' without ffmpeg")
+    return _read_ffmpeg(file, sr, duration, ffmpeg)
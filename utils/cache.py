@@ -0,0 +1,128 @@
+import os
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.logger import Logger
+
+# Decoded audio is stored at half precision, which is plenty for cross-correlation and halves the cache size
+_CACHE_DTYPE = np.float16
+
+
+class DecodeCache:
+    """
+    On-disk cache of decoded mono PCM as memory-mappable ``.npy`` files.
+
+    Entries are keyed by the source file's path, size and modification time together with the decode parameters,
+    so a changed file or different settings never hit a stale entry. The directory is kept under ``max_size``
+    bytes by evicting the least recently used entries. It is scanned once on start-up, entries and their sizes are
+    tracked in memory from then on.
+    """
+
+    def __init__(self, directory: str, max_size: int, logger: Logger):
+        self.directory = directory
+        self.max_size = max_size
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        # Entry path -> size in bytes, least recently used first
+        self._entries = OrderedDict()
+        self._total = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._scan()
+        self.evict()
+
+    def _scan(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        for _, size, path in sorted(entries):
+            self._entries[path] = size
+        self._total = sum(self._entries.values())
+
+    def _track(self, path, size):
+        with self._lock:
+            self._total += size - self._entries.pop(path, 0)
+            self._entries[path] = size
+
+    def key(self, file, *params):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+
+        parts = [os.path.abspath(file), stat.st_size, stat.st_mtime_ns, *params]
+        return hashlib.sha1("\0".join(map(str, parts)).encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npy")
+
+    def get(self, key):
+        if key is None:
+            return None
+
+        path = self._path(key)
+        try:
+            samples = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+
+        try:
+            # Refresh the entry for LRU eviction, atime is unreliable on noatime mounts
+            os.utime(path)
+        except OSError:
+            pass
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                return samples
+        # Written by another process since the directory was scanned
+        try:
+            self._track(path, os.path.getsize(path))
+        except OSError:
+            pass
+        return samples
+
+    def put(self, key, samples):
+        if key is None:
+            return
+
+        path = self._path(key)
+        temp = os.path.join(self.directory, f".{key}.{uuid.uuid4().hex}.tmp")
+        try:
+            with open(temp, "wb") as f:
+                np.save(f, np.asarray(samples, dtype=_CACHE_DTYPE))
+                size = f.tell()
+            os.replace(temp, path)
+        except OSError as e:
+            self.logger.error(f"\tCould not write cache entry '{path}': '{e}'")
+            if os.path.exists(temp):
+                os.remove(temp)
+            return
+
+        self._track(path, size)
+        if self._total > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits into ``max_size`` again."""
+        with self._lock:
+            while self._total > self.max_size and self._entries:
+                path, size = self._entries.popitem(last=False)
+                self._total -= size
+                try:
+                    os.remove(path)
+                    self.logger.debug(f"\tEvicted cache entry '{path}'")
+                except OSError:
+                    pass
@@ -0,0 +1,390 @@
+import time
+from math import gcd
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy import fft
+from scipy.signal import resample_poly
+
+from utils.shared import share_array, attach_array
+
+# How many overlap-save blocks are transformed at once, bounds the temporary spectra per call
+_BLOCKS_PER_BATCH = 64
+_MIN_BLOCK_SIZE = 1 << 14
+# Share of the correlation around the peak that counts as main lobe rather than sidelobe
+_MAIN_LOBE = 0.001
+# Needle spectra kept per filter for haystacks short enough to be transformed whole
+_WHOLE_SPECTRA = 4
+
+
+def _next_pow2(value):
+    return 1 << (int(value) - 1).bit_length()
+
+
+def peak_statistics(c, peak, top=0):
+    """
+    Describe how clearly a correlation peak stands out, without sorting or copying the correlation.
+
+    Returns ``psr`` (how many standard deviations the peak stands above the sidelobes), ``ratio`` (peak over the
+    highest sidelobe, ``None`` if there is none above zero) and ``top``, the indices of up to ``top`` separate peaks
+    in descending order.
+    """
+    exclusion = max(1, int(len(c) * _MAIN_LOBE))
+    low, high = max(0, peak - exclusion), min(len(c), peak + exclusion + 1)
+    statistics = {"psr": 0.0, "ratio": None}
+
+    count = len(c) - (high - low)
+    if count >= 2:
+        # Sidelobe statistics from running sums over everything outside the main lobe
+        main_lobe = c[low:high].astype(np.float64)
+        total = c.sum(dtype=np.float64) - main_lobe.sum()
+        squares = float(np.dot(c, c)) - np.dot(main_lobe, main_lobe)
+        mean = total / count
+        deviation = np.sqrt(max(squares / count - mean * mean, 0.0))
+        if deviation > 0:
+            statistics["psr"] = float((c[peak] - mean) / deviation)
+
+    if count > 0:
+        second = max(c[:low].max(initial=-np.inf), c[high:].max(initial=-np.inf))
+        if second > 0:
+            statistics["ratio"] = float(c[peak] / second)
+
+    if top > 0:
+        statistics["top"] = top_peaks(c, top, exclusion)
+
+    return statistics
+
+
+def top_peaks(c, count, exclusion):
+    """Indices of up to ``count`` peaks at least ``exclusion`` samples apart, best first."""
+    candidates = np.argpartition(c, len(c) - min(len(c), count * 64))[len(c) - min(len(c), count * 64):]
+
+    peaks = []
+    for candidate in candidates[np.argsort(c[candidates])[::-1]]:
+        if all(abs(int(candidate) - peak) > exclusion for peak in peaks):
+            peaks.append(int(candidate))
+            if len(peaks) == count:
+                break
+
+    return peaks
+
+
+def _stacks(haystacks):
+    """Group haystacks by length, yielding the indices of every group and its haystacks as rows of a 2-D array."""
+    groups = {}
+    for i, haystack in enumerate(haystacks):
+        groups.setdefault(len(haystack), []).append(i)
+
+    for indices in groups.values():
+        if len(indices) == 1:
+            yield indices, np.asarray(haystacks[indices[0]], dtype=np.float32)[None, :]
+        else:
+            yield indices, np.stack([np.asarray(haystacks[i], dtype=np.float32) for i in indices])
+
+
+def _share(timings, indices, stage, seconds):
+    # Haystacks searched together split the time evenly
+    if timings is not None:
+        for i in indices:
+            timings[i][stage] = seconds / len(indices)
+
+
+def normalised_score(value, needle_norm, segment):
+    """Normalised cross-correlation of a match, 1.0 for a perfect (scaled) copy of the needle."""
+    norm = needle_norm * float(np.linalg.norm(segment))
+    return float(value / norm) if norm > 0 else 0.0
+
+
+class MatchedFilter:
+    """
+    Overlap-save cross-correlation against a fixed set of needles.
+
+    The needle spectra are computed once for a fixed block size and reused for every haystack, so a haystack
+    costs one forward FFT per block plus one batched inverse FFT per block for all needles. Each output equals
+    ``scipy.signal.correlate(haystack, needle, mode='valid')`` for the respective needle.
+    """
+
+    def __init__(self, needles, block_size=None):
+        needles = [np.ascontiguousarray(needle, dtype=np.float32) for needle in needles]
+
+        self.needle_lengths = tuple(len(needle) for needle in needles)
+        self.needle_norms = tuple(float(np.linalg.norm(needle)) for needle in needles)
+        longest = max(self.needle_lengths)
+        self.block_size = block_size or _next_pow2(max(4 * longest, _MIN_BLOCK_SIZE))
+        if self.block_size < longest:
+            raise ValueError(f"Block size {self.block_size} is smaller than the longest needle ({longest}).")
+        self.step = self.block_size - longest + 1
+
+        self.needles = np.stack([np.pad(needle, (0, longest - len(needle))) for needle in needles])
+        self.spectra = np.conj(fft.rfft(self.needles, self.block_size, axis=1))
+        self._whole_spectra = {}
+        self._shm = None
+
+    def share(self):
+        """
+        Move the spectra and needles into shared memory so worker processes can map them instead of receiving a
+        pickled copy.
+
+        Returns the owning ``SharedMemory`` blocks and a descriptor for ``MatchedFilter.attach``.
+        """
+        spectra_shm, spectra = share_array(self.spectra)
+        needles_shm, needles = share_array(self.needles)
+        return [spectra_shm, needles_shm], (self.needle_lengths, self.needle_norms, self.block_size, spectra, needles)
+
+    @classmethod
+    def attach(cls, descriptor):
+        needle_lengths, needle_norms, block_size, spectra, needles = descriptor
+
+        matched_filter = cls.__new__(cls)
+        matched_filter.needle_lengths = needle_lengths
+        matched_filter.needle_norms = needle_norms
+        matched_filter.block_size = block_size
+        matched_filter.step = block_size - max(needle_lengths) + 1
+        spectra_shm, matched_filter.spectra = attach_array(spectra)
+        needles_shm, matched_filter.needles = attach_array(needles)
+        matched_filter._whole_spectra = {}
+        matched_filter._shm = [spectra_shm, needles_shm]
+
+        return matched_filter
+
+    def _spectra(self, size):
+        spectra = self._whole_spectra.pop(size, None)
+        if spectra is None:
+            spectra = np.conj(fft.rfft(self.needles, size, axis=1))
+            if len(self._whole_spectra) >= _WHOLE_SPECTRA:
+                del self._whole_spectra[next(iter(self._whole_spectra))]
+        # Most recently used last, haystacks capped at the window share one size
+        self._whole_spectra[size] = spectra
+        return spectra
+
+    def correlate_stack(self, stack):
+        """
+        Correlate equally long haystacks, the rows of a 2-D ``stack``, against every needle at once.
+
+        Rows that fit into fewer samples than their overlap-save blocks are transformed whole, otherwise the blocks
+        of all rows are transformed together. Returns an array of shape ``(needles, rows, samples)`` and the valid
+        length per needle, samples past it are undefined.
+        """
+        length = stack.shape[1]
+        valid = [length - needle_length + 1 for needle_length in self.needle_lengths]
+        if max(valid) < 1:
+            raise ValueError(f"Haystack ({length} samples) is shorter than every needle "
+                             f"({min(self.needle_lengths)} samples or more).")
+
+        # Blocks cover the shortest needle's valid range; the step keeps the longest needle free of wrap-around
+        blocks = -(-max(valid) // self.step)
+        size = fft.next_fast_len(length, real=True)
+        if size < blocks * self.block_size:
+            # A single transform of at least the haystack's length has no wrap-around within the valid range
+            return fft.irfft(fft.rfft(stack, size, axis=1)[None] * self._spectra(size)[:, None, :], size,
+                             axis=2).astype(np.float32, copy=False), valid
+
+        padded = np.zeros((len(stack), (blocks - 1) * self.step + self.block_size), dtype=np.float32)
+        padded[:, :length] = stack
+
+        frames = as_strided(padded, shape=(len(stack), blocks, self.block_size),
+                            strides=(padded.strides[0], self.step * padded.itemsize, padded.itemsize),
+                            writeable=False)
+
+        batch = max(1, _BLOCKS_PER_BATCH // (len(self.needle_lengths) * len(stack)))
+        output = np.empty((len(self.needle_lengths), len(stack), blocks, self.step), dtype=np.float32)
+        for start in range(0, blocks, batch):
+            chunk = frames[:, start:start + batch]
+            output[:, :, start:start + chunk.shape[1]] = fft.irfft(
+                fft.rfft(chunk, axis=2)[None] * self.spectra[:, None, None, :], self.block_size, axis=3
+            )[..., :self.step]
+
+        return output.reshape(len(self.needle_lengths), len(stack), -1), valid
+
+    def correlate(self, haystack):
+        """
+        Correlate a haystack against every needle.
+
+        Returns one array per needle, empty for needles that are longer than the haystack.
+        """
+        output, valid = self.correlate_stack(np.asarray(haystack, dtype=np.float32)[None, :])
+        return [output[i, 0, :max(length, 0)] for i, length in enumerate(valid)]
+
+    def find(self, haystack, top=0, timings=None):
+        """
+        Find every needle in a haystack.
+
+        Returns one match per needle, ``None`` for needles longer than the haystack. A match holds the ``peak``
+        sample index, its normalised cross-correlation ``score`` and the ``peak_statistics`` of the correlation.
+        If ``timings`` is given, the seconds spent correlating are stored in it under ``correlate``.
+        """
+        return self.find_many([haystack], top, None if timings is None else [timings])[0]
+
+    def find_many(self, haystacks, top=0, timings=None):
+        """
+        Find every needle in several haystacks at once.
+
+        Haystacks of equal length are correlated as one stack and their peaks picked together. Returns the matches
+        of ``find`` per haystack. ``timings`` holds a dict per haystack, each gets its share of the seconds spent.
+        """
+        matches = [None] * len(haystacks)
+        for indices, stack in _stacks(haystacks):
+            start = time.perf_counter()
+            if stack.shape[1] < min(self.needle_lengths):
+                for index in indices:
+                    matches[index] = [None] * len(self.needle_lengths)
+                continue
+
+            output, valid = self.correlate_stack(stack)
+            peaks = [np.argmax(output[i, :, :length], axis=1) if length > 0 else None
+                     for i, length in enumerate(valid)]
+            for row, index in enumerate(indices):
+                matches[index] = []
+                for i, (length, norm) in enumerate(zip(self.needle_lengths, self.needle_norms)):
+                    if peaks[i] is None:
+                        matches[index].append(None)
+                        continue
+
+                    c, peak = output[i, row, :valid[i]], int(peaks[i][row])
+                    matches[index].append({
+                        "peak": peak,
+                        "score": normalised_score(c[peak], norm, stack[row, peak:peak + length]),
+                        **peak_statistics(c, peak, top)
+                    })
+
+            _share(timings, indices, "correlate", time.perf_counter() - start)
+        return matches
+
+
+class CoarseToFineFilter:
+    """
+    Two stage search that correlates at a low analysis sample rate first.
+
+    The haystack is decimated to ``analysis_sr`` and searched with a ``MatchedFilter`` of the equally decimated
+    needles. Only a few samples around the best coarse candidates are then correlated at the full sample rate,
+    which keeps the result sample accurate at a fraction of the FFT size.
+    """
+
+    def __init__(self, needles, sr, analysis_sr, candidates=3):
+        divisor = gcd(int(sr), int(analysis_sr))
+        self.up = int(analysis_sr) // divisor
+        self.down = int(sr) // divisor
+        self.candidates = candidates
+
+        self.needles = [np.ascontiguousarray(needle, dtype=np.float32) for needle in needles]
+        self.needle_lengths = tuple(len(needle) for needle in self.needles)
+        self.needle_norms = tuple(float(np.linalg.norm(needle)) for needle in self.needles)
+        self.coarse = MatchedFilter([self.decimate(needle) for needle in self.needles])
+        self._shm = None
+
+    @property
+    def block_size(self):
+        return self.coarse.block_size
+
+    def decimate(self, samples):
+        return resample_poly(np.asarray(samples, dtype=np.float32), self.up, self.down, axis=-1).astype(np.float32)
+
+    def share(self):
+        """
+        Move the coarse spectra and the full rate needles into shared memory.
+
+        Returns the owning ``SharedMemory`` blocks and a descriptor for ``CoarseToFineFilter.attach``.
+        """
+        shms, coarse = self.coarse.share()
+        needles = []
+        for needle in self.needles:
+            shm, descriptor = share_array(needle)
+            shms.append(shm)
+            needles.append(descriptor)
+
+        return shms, (self.up, self.down, self.candidates, coarse, needles)
+
+    @classmethod
+    def attach(cls, descriptor):
+        up, down, candidates, coarse, needles = descriptor
+
+        search = cls.__new__(cls)
+        search.up, search.down, search.candidates = up, down, candidates
+        search.coarse = MatchedFilter.attach(coarse)
+        search._shm = list(search.coarse._shm)
+        search.needles = []
+        for needle in needles:
+            shm, array = attach_array(needle)
+            search._shm.append(shm)
+            search.needles.append(array)
+        search.needle_lengths = tuple(len(needle) for needle in search.needles)
+        search.needle_norms = tuple(float(np.linalg.norm(needle)) for needle in search.needles)
+
+        return search
+
+    def _refine(self, haystack, needle, candidates):
+        # The coarse peak can drift by about a coarse sample, search two coarse samples either side
+        radius = 2 * -(-self.down // self.up)
+        last = len(haystack) - len(needle)
+
+        best, best_value = -1, -np.inf
+        for candidate in candidates:
+            center = candidate * self.down // self.up
+            for lag in range(max(0, center - radius), min(last, center + radius) + 1):
+                value = np.dot(haystack[lag:lag + len(needle)], needle)
+                if value > best_value:
+                    best, best_value = lag, value
+
+        return best, best_value
+
+    def find(self, haystack, top=0, timings=None):
+        """
+        Find every needle in a haystack.
+
+        Returns the same matches as ``MatchedFilter.find``. The peak and score are refined at the full sample rate,
+        the peak statistics and further top peaks come from the coarse correlation. ``timings`` receives the
+        seconds spent decimating the haystack under ``resample`` and the rest under ``correlate``.
+        """
+        return self.find_many([haystack], top, None if timings is None else [timings])[0]
+
+    def find_many(self, haystacks, top=0, timings=None):
+        """
+        Find every needle in several haystacks at once.
+
+        Haystacks of equal length are decimated and coarsely correlated as one stack, the coarse candidates of all
+        of them are picked together. Returns the matches of ``find`` per haystack, ``timings`` as for
+        ``MatchedFilter.find_many``.
+        """
+        matches = [None] * len(haystacks)
+        for indices, stack in _stacks(haystacks):
+            start = time.perf_counter()
+            decimated = self.decimate(stack)
+            resampled = time.perf_counter()
+            if decimated.shape[1] < min(self.coarse.needle_lengths):
+                for index in indices:
+                    matches[index] = [None] * len(self.needles)
+                continue
+
+            output, valid = self.coarse.correlate_stack(decimated)
+            candidates = []
+            for i, length in enumerate(valid):
+                count = min(self.candidates, max(length, 0))
+                candidates.append(None if count == 0 else
+                                  np.argpartition(output[i, :, :length], length - count, axis=1)[:, length - count:])
+
+            for row, index in enumerate(indices):
+                haystack = stack[row]
+                matches[index] = []
+                for i, (needle, norm) in enumerate(zip(self.needles, self.needle_norms)):
+                    if candidates[i] is None or len(haystack) < len(needle):
+                        matches[index].append(None)
+                        continue
+
+                    c, found = output[i, row, :valid[i]], candidates[i][row]
+                    peak, value = self._refine(haystack, needle, found)
+
+                    statistics = peak_statistics(c, int(found[np.argmax(c[found])]), top)
+                    if top > 0:
+                        statistics["top"] = [peak] + [
+                            candidate * self.down // self.up for candidate in statistics["top"][1:]
+                        ]
+
+                    matches[index].append({
+                        "peak": peak,
+                        "score": normalised_score(value, norm, haystack[peak:peak + len(needle)]),
+                        **statistics
+                    })
+
+            _share(timings, indices, "resample", resampled - start)
+            _share(timings, indices, "correlate", time.perf_counter() - resampled)
+        return matches
@@ -0,0 +1,189 @@
+import os
+import sqlite3
+import threading
+from math import gcd
+from collections import Counter, defaultdict
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+from scipy.ndimage import maximum_filter
+from scipy.signal import resample_poly
+
+# Landmarks are computed on a fixed low rate spectrogram, independent of the rate the audio was decoded at
+FINGERPRINT_RATE = 8000
+_FFT_SIZE = 1024
+_HOP = 256
+_FREQUENCY_BINS = 512
+
+# Peak picking neighbourhood (frames, bins) and density
+_PEAK_NEIGHBOURHOOD = (15, 15)
+_PEAKS_PER_SECOND = 30
+# Every anchor peak is paired with the next peaks at most _MAX_DELTA frames later
+_FAN_OUT = 10
+_MAX_DELTA = 63
+
+# Matching landmarks needed before an offset counts as a candidate
+MIN_VOTES = 5
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    duration REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS hashes (
+    hash INTEGER NOT NULL,
+    file_id INTEGER NOT NULL,
+    time INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hashes_hash ON hashes (hash);
+CREATE INDEX IF NOT EXISTS hashes_file ON hashes (file_id);
+"""
+
+
+def frames_to_seconds(frames):
+    return frames * _HOP / FINGERPRINT_RATE
+
+
+def landmarks(samples, sr):
+    """
+    Spectral peak landmarks of a signal.
+
+    Peaks of the log magnitude spectrogram are paired into ``(anchor frequency, target frequency, time delta)``
+    hashes. Returns the hashes and the anchor frame of each as two int64 arrays.
+    """
+    samples = np.asarray(samples, dtype=np.float32)
+    if sr != FINGERPRINT_RATE:
+        divisor = gcd(int(sr), FINGERPRINT_RATE)
+        samples = resample_poly(samples, FINGERPRINT_RATE // divisor, int(sr) // divisor).astype(np.float32)
+
+    empty = np.zeros(0, dtype=np.int64)
+    count = 1 + (len(samples) - _FFT_SIZE) // _HOP
+    if count < 2:
+        return empty, empty
+
+    frames = as_strided(samples, shape=(count, _FFT_SIZE), strides=(_HOP * samples.itemsize, samples.itemsize),
+                        writeable=False)
+    spectrogram = np.log(np.abs(np.fft.rfft(frames * np.hanning(_FFT_SIZE), axis=1))[:, :_FREQUENCY_BINS] + 1e-6)
+
+    is_peak = (spectrogram == maximum_filter(spectrogram, size=_PEAK_NEIGHBOURHOOD)) & \
+              (spectrogram > spectrogram.mean())
+    times, frequencies = np.nonzero(is_peak)
+
+    # Keep the strongest peaks only, then order them in time for pairing
+    limit = max(1, int(frames_to_seconds(count) * _PEAKS_PER_SECOND))
+    if len(times) > limit:
+        strongest = np.argpartition(spectrogram[times, frequencies], len(times) - limit)[len(times) - limit:]
+        times, frequencies = times[strongest], frequencies[strongest]
+    order = np.lexsort((frequencies, times))
+    times, frequencies = times[order].astype(np.int64), frequencies[order].astype(np.int64)
+
+    hashes, anchors = [], []
+    for shift in range(1, _FAN_OUT + 1):
+        delta = times[shift:] - times[:-shift]
+        valid = (delta > 0) & (delta <= _MAX_DELTA)
+        hashes.append((frequencies[:-shift][valid] << 15) | (frequencies[shift:][valid] << 6) | delta[valid])
+        anchors.append(times[:-shift][valid])
+
+    if not hashes:
+        return empty, empty
+    return np.concatenate(hashes), np.concatenate(anchors)
+
+
+class FingerprintIndex:
+    """
+    SQLite index of landmark hashes of the searched files.
+
+    Files are fingerprinted once over the window they were decoded for, entries are invalidated when the file's
+    size or modification time changes. Queries look up a needle's hashes and vote on the offset between needle and
+    file landmarks.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def indexed(self, files, duration):
+        """Map every file with a current entry covering at least ``duration`` seconds to its id."""
+        ids = {}
+        with self._lock:
+            for file in files:
+                row = self._connection.execute("SELECT id, size, mtime, duration FROM files WHERE path = ?",
+                                               (os.path.abspath(file),)).fetchone()
+                if row is None:
+                    continue
+                try:
+                    stat = os.stat(file)
+                except OSError:
+                    continue
+                if row[1] == stat.st_size and row[2] == stat.st_mtime_ns and row[3] >= duration:
+                    ids[file] = row[0]
+        return ids
+
+    def add(self, file, hashes, anchors, duration):
+        stat = os.stat(file)
+        path = os.path.abspath(file)
+
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+            if row is not None:
+                self._connection.execute("DELETE FROM hashes WHERE file_id = ?", (row[0],))
+                self._connection.execute("DELETE FROM files WHERE id = ?", (row[0],))
+
+            file_id = self._connection.execute(
+                "INSERT INTO files (path, size, mtime, duration) VALUES (?, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, duration)
+            ).lastrowid
+            self._connection.executemany(
+                "INSERT INTO hashes (hash, file_id, time) VALUES (?, ?, ?)",
+                ((int(h), file_id, int(t)) for h, t in zip(hashes, anchors))
+            )
+
+    def query(self, hashes, anchors, file_ids, limit=None):
+        """
+        Vote on the offset of a needle in every indexed file.
+
+        Returns ``{file_id: (offset in seconds, votes)}`` for files with at least ``MIN_VOTES`` aligned landmarks,
+        offsets past ``limit`` seconds are ignored.
+        """
+        needle_times = defaultdict(list)
+        for h, t in zip(hashes.tolist(), anchors.tolist()):
+            needle_times[h].append(t)
+
+        wanted = set(file_ids)
+        votes = Counter()
+        keys = list(needle_times)
+        with self._lock:
+            # Stay below SQLite's bound parameter limit
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._connection.execute(
+                    f"SELECT hash, file_id, time FROM hashes WHERE hash IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for h, file_id, time in rows:
+                    if file_id not in wanted:
+                        continue
+                    for needle_time in needle_times[h]:
+                        votes[(file_id, time - needle_time)] += 1
+
+        best = {}
+        for (file_id, delta), count in votes.items():
+            # Needle and file frames rarely line up exactly, neighbouring offsets vote for each other
+            count += votes.get((file_id, delta - 1), 0) + votes.get((file_id, delta + 1), 0)
+            if delta < 0 or count < MIN_VOTES or (limit is not None and frames_to_seconds(delta) > limit):
+                continue
+            if file_id not in best or count > best[file_id][1]:
+                best[file_id] = (frames_to_seconds(delta), count)
+
+        return best
@@ -0,0 +1,114 @@
+import json
+
+# Seconds summed per file and per batch, in the order they happen to a window
+STAGES = ("schedule_wait", "decode", "queue_wait", "pool_wait", "resample", "correlate", "fingerprint")
+
+
+def add_window(metrics, window):
+    """Add the measurements of one decoded and searched window to a file's metrics."""
+    metrics["windows"] = metrics.get("windows", 0) + 1
+    metrics["samples"] = metrics.get("samples", 0) + window.get("samples", 0)
+    for stage in STAGES:
+        metrics[stage] = round(metrics.get(stage, 0.0) + window.get(stage, 0.0), 6)
+
+    if window.get("source") is not None and window["source"] not in metrics.setdefault("sources", []):
+        metrics["sources"].append(window["source"])
+    if window.get("pid") is not None and window["pid"] not in metrics.setdefault("pids", []):
+        metrics["pids"].append(window["pid"])
+
+    return metrics
+
+
+def add_file(totals, metrics):
+    """Add the metrics of a complete file to the running totals of a run, so the file's own need not be kept."""
+    totals["files"] = totals.get("files", 0) + 1
+    totals["windows"] = totals.get("windows", 0) + metrics.get("windows", 0)
+    totals["samples"] = totals.get("samples", 0) + metrics.get("samples", 0)
+    for stage in STAGES:
+        totals[stage] = totals.get(stage, 0.0) + metrics.get(stage, 0.0)
+    totals["max_queue_wait"] = max(totals.get("max_queue_wait", 0.0), metrics.get("queue_wait", 0.0))
+    totals.setdefault("pids", set()).update(metrics.get("pids", []))
+
+    return totals
+
+
+def summarise(files, wall, totals=None):
+    """
+    Totals over all files of a run that took ``wall`` seconds.
+
+    They are taken from the running ``totals`` of ``add_file`` if given, otherwise from the per-file metrics.
+    """
+    if totals is None:
+        totals = {}
+        for metrics in files.values():
+            add_file(totals, metrics)
+
+    count = totals.get("files", 0)
+    batch = {
+        "files": count,
+        "windows": totals.get("windows", 0),
+        "samples": totals.get("samples", 0),
+        "wall": round(wall, 6),
+        "files_per_second": round(count / wall, 3) if wall > 0 else 0.0,
+        "workers": len(totals.get("pids", ())),
+    }
+    for stage in STAGES:
+        batch[stage] = round(totals.get(stage, 0.0), 6)
+    batch["max_queue_wait"] = round(totals.get("max_queue_wait", 0.0), 6)
+
+    return {"files": files, "batch": batch}
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def to_prometheus(metrics):
+    """Render ``summarise`` output in the Prometheus text exposition format."""
+    batch = metrics["batch"]
+    lines = [
+        "# HELP aivd_files Files searched in the run.",
+        "# TYPE aivd_files gauge",
+        f"aivd_files {batch['files']}",
+        "# HELP aivd_windows Windows decoded and searched in the run.",
+        "# TYPE aivd_windows gauge",
+        f"aivd_windows {batch['windows']}",
+        "# HELP aivd_samples Samples correlated in the run.",
+        "# TYPE aivd_samples gauge",
+        f"aivd_samples {batch['samples']}",
+        "# HELP aivd_wall_seconds Wall clock time of the run.",
+        "# TYPE aivd_wall_seconds gauge",
+        f"aivd_wall_seconds {batch['wall']}",
+        "# HELP aivd_stage_seconds Seconds spent per stage, summed over all files.",
+        "# TYPE aivd_stage_seconds gauge",
+    ]
+    lines.extend(f"aivd_stage_seconds{{stage=\"{stage}\"}} {batch[stage]}" for stage in STAGES)
+
+    lines.extend([
+        "# HELP aivd_file_stage_seconds Seconds spent per stage for a single file.",
+        "# TYPE aivd_file_stage_seconds gauge",
+    ])
+    for file, file_metrics in metrics["files"].items():
+        lines.extend(f"aivd_file_stage_seconds{{file=\"{_label(file)}\",stage=\"{stage}\"}} "
+                     f"{file_metrics.get(stage, 0.0)}" for stage in STAGES)
+
+    lines.extend([
+        "# HELP aivd_file_samples Samples correlated for a single file.",
+        "# TYPE aivd_file_samples gauge",
+    ])
+    lines.extend(f"aivd_file_samples{{file=\"{_label(file)}\"}} {file_metrics.get('samples', 0)}"
+                 for file, file_metrics in metrics["files"].items())
+
+    return "\n".join(lines) + "\n"
+
+
+def write(path, metrics, format_="jsonl"):
+    """Write ``summarise`` output as JSON Lines (one line per file, then the batch) or Prometheus text."""
+    with open(path, "w") as f:
+        if format_ == "prometheus":
+            f.write(to_prometheus(metrics))
+            return
+
+        for file, file_metrics in metrics["files"].items():
+            f.write(json.dumps({"file": file, **file_metrics}) + "\n")
+        f.write(json.dumps({"batch": metrics["batch"]}) + "\n")
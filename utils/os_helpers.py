@@ -1,6 +1,6 @@
 import os
+import hashlib
 import subprocess
-import multiprocessing
 
 from utils.logger import Logger
 
@@ -11,36 +11,65 @@ def find_ffmpeg():
 
 
 def thread_count():
-    return multiprocessing.cpu_count()
+    return os.cpu_count() or 1
 
 
-def file_walker(files_path, logging: Logger, recursive=False, extension="*", extension_skip=""):
-    files = os.listdir(files_path)
-    output = []
-
-    for i, file in enumerate(files):
-        file = os.path.join(files_path, file)
-
-        if not os.path.isfile(file) and recursive:
-            output.extend(
-                file_walker(file, logging, recursive, extension, extension_skip)
-            )
-            continue
+def _extensions(extensions):
+    # Split once up front, str.endswith takes the whole tuple in a single call
+    return tuple(val for val in extensions.split(",") if val != "")
 
-        if extension != "*" and True not in [file.endswith(val) for val in extension.split(",")]:
-            logging.debug(f"Skipping file {i + 1} ('{file}') of {len(files)} as "
-                          f"it does not match the specified file extension '{extension}'")
-            continue
 
-        if extension_skip != "" and True in [file.endswith(val) for val in extension_skip.split(",")]:
-            logging.debug(f"Skipping file {i + 1} ('{file}') of {len(files)} as "
-                          f"it matches the specified file extension '{extension_skip}'")
-            continue
-
-        logging.debug(f"Found file '{file}' ({i + 1} of {len(files)})")
-        output.append(file)
-
-    return output
+def file_walker(files_path, logging: Logger, recursive=False, extension="*", extension_skip=""):
+    """
+    Lazily yield the files in ``files_path`` that match ``extension`` and not ``extension_skip``.
+
+    Directory entries are read with ``os.scandir``, whose cached type information spares a ``stat`` call per entry,
+    and every file is yielded as soon as it is found so work can start before the walk is complete.
+    """
+    included = None if extension == "*" else _extensions(extension)
+    skipped = _extensions(extension_skip)
+
+    try:
+        with os.scandir(files_path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    if recursive:
+                        yield from file_walker(entry.path, logging, recursive, extension, extension_skip)
+                    continue
+                if not entry.is_file():
+                    continue
+
+                file = entry.path
+                if included is not None and not file.endswith(included):
+                    logging.debug(f"Skipping file '{file}' as it does not match the specified file extension "
+                                  f"'{extension}'")
+                    continue
+
+                if skipped and file.endswith(skipped):
+                    logging.debug(f"Skipping file '{file}' as it matches the specified file extension "
+                                  f"'{extension_skip}'")
+                    continue
+
+                logging.debug(f"Found file '{file}'")
+                yield file
+    except OSError as e:
+        logging.error(f"Could not read directory '{files_path}': '{e}'")
+
+
+def in_shard(file, directory, shard, shards):
+    """
+    Whether ``file`` belongs to the 1-based ``shard`` of ``shards``.
+
+    Files are assigned by a hash of their path relative to ``directory``, so every machine agrees on the split
+    wherever the library is mounted, and independent of the order files are walked in.
+    """
+    path = os.path.relpath(file, directory).replace(os.sep, "/")
+    digest = hashlib.sha1(path.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards == shard - 1
+
+
+def is_audio_file(file):
+    return file.endswith(".wav")
 
 
 def is_audio_files(files):
@@ -48,7 +77,7 @@ def is_audio_files(files):
     to_convert_files = []
 
     for file in files:
-        if file.endswith(".wav"):
+        if is_audio_file(file):
             ready_files.append(file)
         else:
             to_convert_files.append(file)
@@ -0,0 +1,110 @@
+import os
+import json
+import sqlite3
+import threading
+import hashlib
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    needle TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (needle, path)
+);
+"""
+
+
+def needle_key(file, *params):
+    """Identify a base file by its content and the search parameters its results depend on."""
+    digest = hashlib.sha1()
+    with open(file, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    digest.update("\0".join(map(str, params)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultStore:
+    """
+    SQLite store of previous results per base file and searched file.
+
+    A stored result is only returned while the searched file's size and modification time are unchanged.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Lookups run on the thread walking the files, writes on the main thread once detection is done or, when
+        # results are streamed, on whichever thread completes a file
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+        self._connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self._connection.close()
+
+    def get(self, needle, file):
+        try:
+            stat = os.stat(file)
+        except OSError:
+            return None
+
+        with self._lock:
+            row = self._connection.execute("SELECT size, mtime, result FROM results WHERE needle = ? AND path = ?",
+                                           (needle, os.path.abspath(file))).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return json.loads(row[2])
+
+    def put(self, needle, file, result):
+        stat = os.stat(file)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (needle, path, size, mtime, result) VALUES (?, ?, ?, ?, ?)",
+                (needle, os.path.abspath(file), stat.st_size, stat.st_mtime_ns, json.dumps(result))
+            )
+
+
+def _is_line(record):
+    # A json output is keyed by path, a JSON Lines record holds the path as a string
+    return isinstance(record, dict) and (set(record) == {"metrics"} or (
+        isinstance(record.get("file"), str) and ("match" in record or "matches" in record)))
+
+
+def read_output(path):
+    """
+    Read the results of a ``json``, ``raw`` or ``jsonl`` output back into a mapping of file to result.
+
+    An empty output holds no results. A result is a single match, or a mapping of input file to match for searches with several input files. Metrics
+    are left out. Raises ``ValueError`` for anything else.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    # A shard without any files writes nothing at all in jsonl
+    if not text.strip():
+        return {}
+
+    try:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    except json.JSONDecodeError:
+        records = None
+    if records and all(_is_line(record) for record in records):
+        return {record["file"]: record.get("match", record.get("matches")) for record in records if "file" in record}
+
+    data = json.loads(text)
+    if not isinstance(data, dict) or not all(isinstance(result, dict) for result in data.values()):
+        raise ValueError("not an aivd json or jsonl output")
+    data.pop("metrics", None)
+    return data
@@ -0,0 +1,153 @@
+import numpy as np
+
+from utils.fingerprint import MIN_VOTES, frames_to_seconds
+
+# Hashes occurring more often than this in the reference say nothing about where a file lines up with it
+_MAX_REPEATS = 16
+# Aligned landmarks further apart than this many frames (about two seconds) belong to separate shared segments
+_GAP = 63
+# Aligned landmarks a shared segment needs before it counts
+_MIN_CLUSTER = 3
+
+
+class Reference:
+    """
+    The landmarks of one file, sorted by hash, that the other files are aligned against.
+
+    Hashes repeating too often in it are dropped, the rest are looked up with a binary search.
+    """
+
+    def __init__(self, hashes, anchors):
+        unique, counts = np.unique(hashes, return_counts=True)
+        keep = np.isin(hashes, unique[counts <= _MAX_REPEATS])
+        order = np.argsort(hashes[keep], kind="stable")
+        self.hashes = hashes[keep][order]
+        self.anchors = anchors[keep][order]
+        self.frames = int(anchors.max()) + 1 if len(anchors) else 0
+
+    def pairs(self, hashes, anchors):
+        """Every ``(reference frame, file frame)`` pair of equal hashes."""
+        low = np.searchsorted(self.hashes, hashes, "left")
+        counts = np.searchsorted(self.hashes, hashes, "right") - low
+        found = counts > 0
+        low, counts, anchors = low[found], counts[found], anchors[found]
+
+        # Positions low .. low + count - 1 of every matched hash, without a Python loop
+        index = np.repeat(low - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        return self.anchors[index], np.repeat(anchors, counts)
+
+    def align(self, hashes, anchors, within=None):
+        """
+        Vote on the frame delta between a file and the reference.
+
+        Only reference frames in the ``within`` range count, if given. Returns the delta (file frame minus reference
+        frame), its votes and the sorted reference frames of the aligned landmarks, or ``None`` if fewer than
+        ``MIN_VOTES`` landmarks line up.
+        """
+        reference, file = self.pairs(hashes, anchors)
+        if within is not None:
+            inside = (reference >= within[0]) & (reference <= within[1])
+            reference, file = reference[inside], file[inside]
+        if len(reference) == 0:
+            return None
+
+        deltas = file - reference
+        lowest = deltas.min()
+        votes = np.bincount(deltas - lowest)
+        # Frames rarely line up exactly, neighbouring deltas vote for each other
+        smoothed = votes.copy()
+        smoothed[1:] += votes[:-1]
+        smoothed[:-1] += votes[1:]
+
+        best = int(np.argmax(smoothed))
+        if smoothed[best] < MIN_VOTES:
+            return None
+        delta = best + int(lowest)
+        return delta, int(smoothed[best]), np.sort(reference[np.abs(deltas - delta) <= 1])
+
+
+def _intervals(frames):
+    """Group sorted frames into ``(first, last)`` runs of at least ``_MIN_CLUSTER`` frames, split at gaps."""
+    if len(frames) == 0:
+        return []
+
+    splits = np.nonzero(np.diff(frames) > _GAP)[0] + 1
+    return [(int(run[0]), int(run[-1])) for run in np.split(frames, splits) if len(run) >= _MIN_CLUSTER]
+
+
+def longest_shared(reference, fingerprints, min_share):
+    """
+    The longest stretch of the reference that at least ``min_share`` of the other files contain.
+
+    Every file is aligned once against the reference, so the work grows linearly with the number of files. Returns
+    ``(first frame, last frame, files sharing it)`` or ``None``.
+    """
+    coverage = np.zeros(reference.frames + 1, dtype=np.int32)
+    for hashes, anchors in fingerprints:
+        alignment = reference.align(hashes, anchors)
+        if alignment is None:
+            continue
+        for first, last in _intervals(alignment[2]):
+            coverage[first] += 1
+            coverage[last + 1] -= 1
+    coverage = np.cumsum(coverage)[:-1]
+
+    needed = max(1, int(np.ceil(min_share * len(fingerprints))))
+    shared = np.concatenate(([False], coverage >= needed, [False]))
+    edges = np.diff(shared.astype(np.int8))
+    starts, ends = np.nonzero(edges == 1)[0], np.nonzero(edges == -1)[0]
+    if len(starts) == 0:
+        return None
+
+    longest = int(np.argmax(ends - starts))
+    first, last = int(starts[longest]), int(ends[longest]) - 1
+    return first, last, int(coverage[first:last + 1].min())
+
+
+def discover(fingerprints, min_share=0.5, min_length=5.0, references=3):
+    """
+    Find the longest segment most files share and where it starts in each of them.
+
+    ``fingerprints`` holds ``(hashes, anchors)`` landmarks per file, as ``utils.fingerprint.landmarks`` returns them.
+    A few files spread over the list serve as reference in turn, the longest segment shared by at least
+    ``min_share`` of the other files wins. Returns ``None`` if none is at least ``min_length`` seconds long,
+    otherwise the reference's index, the segment's start and length in seconds of the reference, and per file the
+    segment's start in seconds and its votes, ``None`` for files it wasn't found in.
+    """
+    if len(fingerprints) < 2:
+        return None
+
+    best = None
+    candidates = sorted({0, len(fingerprints) // 2, len(fingerprints) - 1})[:max(1, references)]
+    for index in candidates:
+        reference = Reference(*fingerprints[index])
+        others = [fingerprint for i, fingerprint in enumerate(fingerprints) if i != index]
+        segment = longest_shared(reference, others, min_share)
+        if segment is None:
+            continue
+        first, last, count = segment
+        if best is None or (last - first, count) > (best[2] - best[1], best[3]):
+            best = (index, first, last, count, reference)
+
+    if best is None or frames_to_seconds(best[2] - best[1]) < min_length:
+        return None
+
+    index, first, last, _, reference = best
+    offsets = []
+    for i, (hashes, anchors) in enumerate(fingerprints):
+        if i == index:
+            offsets.append((frames_to_seconds(first), None))
+            continue
+        # Aligned on the segment only, other shared parts of the file may line up differently
+        alignment = reference.align(hashes, anchors, (first, last))
+        if alignment is None:
+            offsets.append(None)
+        else:
+            offsets.append((frames_to_seconds(max(first + alignment[0], 0)), alignment[1]))
+
+    return {
+        "reference": index,
+        "start": frames_to_seconds(first),
+        "duration": frames_to_seconds(last - first),
+        "offsets": offsets
+    }
@@ -0,0 +1,42 @@
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+
+def share_array(array):
+    """
+    Copy an array into a new shared memory block.
+
+    Returns the owning ``SharedMemory`` (the caller is responsible for ``close()`` and ``unlink()``) and a small
+    picklable descriptor that other processes can pass to ``attach_array``.
+    """
+    array = np.ascontiguousarray(array)
+    shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(descriptor):
+    """
+    Map an array shared with ``share_array`` without copying it.
+
+    Returns the attached ``SharedMemory`` (to be ``close()``d once the array is no longer used) and the array view.
+    """
+    name, shape, dtype = descriptor
+    shm = SharedMemory(name=name)
+
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def release(shm, unlink=False):
+    """Close a shared memory block and optionally remove it, tolerating views that are still alive."""
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+    try:
+        shm.close()
+    except BufferError:
+        pass
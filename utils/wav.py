@@ -0,0 +1,101 @@
+import os
+import struct
+
+import numpy as np
+from math import gcd
+from scipy.signal import resample_poly
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_IEEE_FLOAT = 0x0003
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _chunks(f):
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        chunk_id, size = struct.unpack("<4sI", header)
+        offset = f.tell()
+        yield chunk_id, offset, size
+        # Chunks are word aligned
+        f.seek(offset + size + (size & 1))
+
+
+def read_header(file):
+    """
+    Parse the RIFF header of a WAV file.
+
+    Returns ``(format_tag, channels, sample_rate, bits, data_offset, data_size)`` or ``None`` if the file is not a
+    WAV file this module can map.
+    """
+    with open(file, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            return None
+
+        fmt = None
+        for chunk_id, offset, size in _chunks(f):
+            if chunk_id == b"fmt ":
+                f.seek(offset)
+                fmt = f.read(size)
+            elif chunk_id == b"data" and fmt is not None:
+                format_tag, channels, sample_rate, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+                if format_tag == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+                    format_tag = struct.unpack("<H", fmt[24:26])[0]
+                # Streamed WAVs may carry a placeholder size, never map past the end of the file
+                return format_tag, channels, sample_rate, bits, offset, min(size, os.path.getsize(file) - offset)
+
+    return None
+
+
+def duration(file):
+    """The length of a WAV file in seconds, or ``None`` if it is not a WAV file this module can map."""
+    header = read_header(file)
+    if header is None:
+        return None
+    _, channels, sample_rate, bits, _, size = header
+    return size // (channels * bits // 8) / sample_rate
+
+
+def read_window(file, window=None, target_rate=None, start=0):
+    """
+    Map the PCM data of a WAV file and return ``window`` seconds from ``start`` on as mono float32.
+
+    Only the requested frames are read from disk, resampled to ``target_rate`` if given. Returns
+    ``(samples, sample_rate)`` or ``None`` for layouts that have to go through ffmpeg instead (compressed formats,
+    24 bit and other odd sample widths).
+    """
+    header = read_header(file)
+    if header is None:
+        return None
+    format_tag, channels, sample_rate, bits, offset, size = header
+
+    if format_tag == _WAVE_FORMAT_PCM and bits in (8, 16, 32):
+        dtype, scale = {8: (np.uint8, 128.0), 16: (np.int16, 32768.0), 32: (np.int32, 2147483648.0)}[bits]
+    elif format_tag == _WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        dtype, scale = (np.float32 if bits == 32 else np.float64), 1.0
+    else:
+        return None
+
+    frame_size = channels * bits // 8
+    first = min(int(start * sample_rate), size // frame_size)
+    frames = size // frame_size - first
+    if window is not None:
+        frames = min(frames, int(window * sample_rate))
+    if frames == 0:
+        return np.zeros(0, dtype=np.float32), sample_rate
+
+    data = np.memmap(file, dtype=dtype, mode="r", offset=offset + first * frame_size, shape=(frames, channels))
+    samples = data.mean(axis=1, dtype=np.float32)
+    if bits == 8:
+        samples -= 128.0
+    if scale != 1.0:
+        samples /= scale
+
+    if target_rate is not None and target_rate != sample_rate:
+        divisor = gcd(int(target_rate), int(sample_rate))
+        samples = resample_poly(samples, target_rate // divisor, sample_rate // divisor).astype(np.float32)
+        sample_rate = target_rate
+
+    return samples, sample_rate
@@ -0,0 +1,111 @@
+import os
+import socket
+import hashlib
+
+_DONE = "done"
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class WorkQueue:
+    """
+    A directory of lock files that lets several processes, on one host or over a shared filesystem, split a
+    library between them.
+
+    Every process walks the same files and claims each one by creating its lock file exclusively, only the process
+    that created it searches the file. Files are claimed as the search has room for them, so faster processes pull
+    more files. Lock files are named by the path relative to the searched directory, so machines mounting the
+    library elsewhere still agree. Claims of processes on this host that exited before finishing are taken over,
+    claims of other hosts are kept until their lock file is removed.
+    """
+
+    def __init__(self, path, directory):
+        self.path = path
+        self.directory = directory
+        self._owner = f"{socket.gethostname()} {os.getpid()}"
+        self._claimed = []
+        os.makedirs(path, exist_ok=True)
+
+    def _lock_file(self, file):
+        relative = os.path.relpath(file, self.directory).replace(os.sep, "/")
+        return os.path.join(self.path, hashlib.sha1(relative.encode("utf-8")).hexdigest() + ".lock")
+
+    def _create(self, lock_file):
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w") as f:
+            f.write(self._owner + "\n")
+        return True
+
+    def _owner_of(self, lock_file):
+        try:
+            with open(lock_file) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _stale(self, owner):
+        owner = owner.split()
+        # A claim still being written reads empty, it is as good as taken
+        if len(owner) != 2 or owner[0] != socket.gethostname():
+            return False
+        try:
+            return not _alive(int(owner[1]))
+        except ValueError:
+            return False
+
+    def claim(self, file):
+        """Claim ``file`` for this process, ``False`` if another process has or had it."""
+        lock_file = self._lock_file(file)
+        if self._create(lock_file):
+            self._claimed.append(lock_file)
+            return True
+        owner = self._owner_of(lock_file)
+        if owner is None or not self._stale(owner):
+            return False
+
+        # Only one process can move the stale claim away, everyone else's rename fails
+        stale = f"{lock_file}.{os.getpid()}"
+        try:
+            os.rename(lock_file, stale)
+        except FileNotFoundError:
+            return False
+        if self._owner_of(stale) != owner:
+            # Another process took the claim over in between, put its fresh claim back
+            try:
+                os.link(stale, lock_file)
+            except FileExistsError:
+                pass
+            os.unlink(stale)
+            return False
+        os.unlink(stale)
+
+        if self._create(lock_file):
+            self._claimed.append(lock_file)
+            return True
+        return False
+
+    def claimed(self, files):
+        """Lazily yield the files of ``files`` this process claims."""
+        for file in files:
+            if self.claim(file):
+                yield file
+
+    def finish(self):
+        """Mark every file claimed so far as done, no process takes them over afterwards."""
+        for lock_file in self._claimed:
+            temporary = f"{lock_file}.{os.getpid()}"
+            with open(temporary, "w") as f:
+                f.write(_DONE + "\n")
+            os.replace(temporary, lock_file)
+        self._claimed = []